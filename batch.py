@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from database import ScoutingDatabase
+from scanners.legacy import LegacyScanner
+from scanners.scanner import Scanner
+from scanners.template import load_template
+from scanners.timing import ScanStats, SheetTiming
+from watcher import ScanWatcher, is_scan
+
+_scanner = None
+_marked_dir = None
+
+
+def _init_worker(fields_file, config_file, img_dir, marked_dir, legacy):
+    global _scanner, _marked_dir
+    layout = LegacyScanner if legacy else Scanner
+    template = load_template(fields_file, config_file, layout)
+    _scanner = layout(template.fields, template.config, img_dir, headless=marked_dir is None)
+    _scanner.set_template(template)
+    _marked_dir = marked_dir
+
+
+def _scan_file(filepath):
+    """
+    Decodes one scan in a worker process. The sheet's timing is sent back with its data so only the parent process
+    writes the timing log.
+    """
+    filename = os.path.basename(filepath)
+    timing = SheetTiming(filename)
+    try:
+        with timing.stage("read"):
+            img = _scanner.read_scan(filepath)
+        data, marked_sheet = _scanner.scan_sheet(img, timing)
+        if _marked_dir is not None:
+            cv2.imwrite(os.path.join(_marked_dir, filename), marked_sheet.render())
+        _scanner.flush_images()
+        return filename, data, None, timing
+    except Exception as ex:
+        return filename, None, repr(ex), timing
+
+
+class JsonLinesWriter(object):
+    def __init__(self, filepath):
+        self._file = open(filepath, 'a')
+
+    def write(self, filename, data):
+        entry = dict(data)
+        entry['filename'] = filename
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+
+class SqliteWriter(object):
+    """
+    Writes results into the scouting_entries table of a db.sqlite through ScoutingDatabase, where the Data View and
+    the spreadsheet read them. Entries are committed together once batch_size are waiting or the oldest has waited
+    max_delay seconds, and when flushed or closed.
+    """
+
+    def __init__(self, filepath, event, batch_size=100, max_delay=1.0):
+        self._database = ScoutingDatabase(filepath)
+        if self._database.read_only is not None:
+            self._database.close()
+            raise sqlite3.DatabaseError(self._database.read_only)
+        self._event = event
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._pending = []
+        self._oldest = None
+
+    def write(self, filename, data):
+        entry = dict(data)
+        entry['filename'] = filename
+        if not self._pending:
+            self._oldest = time.time()
+        self._pending.append(entry)
+        if len(self._pending) >= self._batch_size or time.time() - self._oldest >= self._max_delay:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            try:
+                self._database.upsert_entries(self._event, pending)
+            except ValueError as ex:  # A team, match or position that isn't a number.
+                print("Writing entries one at a time: {}".format(ex), file=sys.stderr)
+                for entry in pending:
+                    try:
+                        self._database.upsert_entry(self._event, entry)
+                    except ValueError as ex:
+                        print("Couldn't write {}: {}".format(entry['filename'], ex), file=sys.stderr)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._database.close()
+
+
+def find_scans(scan_dir):
+    return sorted(entry.path for entry in os.scandir(scan_dir) if entry.is_file() and is_scan(entry.name))
+
+
+def _prepare_dirs(scan_dir, save_marked):
+    img_dir = os.path.join(scan_dir, 'images', '')
+    marked_dir = os.path.join(scan_dir, 'Marked') if save_marked else None
+    for directory in [img_dir, marked_dir]:
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+    return img_dir, marked_dir
+
+
+def _write_result(future, writer, stats=None):
+    filename, data, error, timing = future.result()
+    if error is not None:
+        print("Failed to scan {}: {}".format(filename, error), file=sys.stderr)
+        return False
+    writer.write(filename, data)
+    if stats is not None:
+        stats.record(timing)
+    return True
+
+
+def scan_directory(scan_dir, fields_file, config_file, writer, workers=None, save_marked=True, legacy=False,
+                   timing_log=None):
+    """
+    Decodes every scan in a directory across a pool of scanner processes, streaming results to the writer as they
+    finish. Returns the number of sheets decoded and the number that failed.
+    """
+    img_dir, marked_dir = _prepare_dirs(scan_dir, save_marked)
+    stats = ScanStats(log_path=timing_log) if timing_log is not None else None
+    decoded, failed = 0, 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(fields_file, config_file, img_dir, marked_dir, legacy)) as executor:
+            futures = [executor.submit(_scan_file, filepath) for filepath in find_scans(scan_dir)]
+            for future in as_completed(futures):
+                if _write_result(future, writer, stats):
+                    decoded += 1
+                else:
+                    failed += 1
+    finally:
+        if stats is not None:
+            stats.close()
+    return decoded, failed
+
+
+def watch_directory(scan_dir, fields_file, config_file, writer, workers=None, save_marked=True, legacy=False,
+                    timing_log=None):
+    """
+    Decodes the scans already in a directory, then keeps decoding new ones as the watcher reports them fully
+    written, until interrupted.
+    """
+    img_dir, marked_dir = _prepare_dirs(scan_dir, save_marked)
+    stats = ScanStats(log_path=timing_log) if timing_log is not None else None
+    watcher = ScanWatcher(scan_dir)
+    futures = set()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(fields_file, config_file, img_dir, marked_dir, legacy)) as executor:
+            arrived = watcher.pending()
+            while True:
+                for filepath in arrived:
+                    watcher.discard(filepath)
+                    futures.add(executor.submit(_scan_file, filepath))
+                for future in [f for f in futures if f.done()]:
+                    futures.remove(future)
+                    _write_result(future, writer, stats)
+                if not futures:
+                    writer.flush()
+                arrived = watcher.wait(0.1 if futures else 1.0)
+    finally:
+        watcher.close()
+        if stats is not None:
+            stats.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decode a directory of scanned sheets without the UI.')
+    parser.add_argument('scan_dir')
+    parser.add_argument('--fields', default='steamworks_fields.json')
+    parser.add_argument('--config', default='steamworks_config.json')
+    parser.add_argument('--output', default='data.jsonl', help='.jsonl file or .sqlite database to write to')
+    parser.add_argument('--event', default=None, help='event id to file entries under in a .sqlite database')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to one per core')
+    parser.add_argument('--no-marked', action='store_true', help="don't save Marked images")
+    parser.add_argument('--legacy', action='store_true', help='use the LegacyScanner layout')
+    parser.add_argument('--watch', action='store_true', help='keep decoding new scans as they arrive')
+    parser.add_argument('--timing-log', default=None, help='.csv or .jsonl file to log per-stage scan times to')
+    args = parser.parse_args()
+
+    if args.output.endswith('.sqlite') or args.output.endswith('.db'):
+        if args.event is None:
+            parser.error('--event is needed to write to a .sqlite database')
+        try:
+            output = SqliteWriter(args.output, args.event)
+        except sqlite3.DatabaseError as ex:
+            parser.error(str(ex))
+    else:
+        output = JsonLinesWriter(args.output)
+    try:
+        if args.watch:
+            watch_directory(args.scan_dir, args.fields, args.config, output, args.workers, not args.no_marked,
+                            args.legacy, args.timing_log)
+        else:
+            num_decoded, num_failed = scan_directory(args.scan_dir, args.fields, args.config, output, args.workers,
+                                                     not args.no_marked, args.legacy, args.timing_log)
+            print("Decoded {} sheets, {} failed".format(num_decoded, num_failed))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        output.close()
@@ -0,0 +1,77 @@
+import inspect
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+import cv2
+
+LAYOUT_MODULES = {'Scanner': 'scanners.scanner', 'LegacyScanner': 'scanners.legacy'}
+
+
+def _opencv3_find_contours(find_contours):
+    """
+    Older commits unpack the (image, contours, hierarchy) that OpenCV 3 returns. Newer code only takes the contours
+    from the end, which works with either.
+    """
+    def wrapper(*args, **kwargs):
+        result = find_contours(*args, **kwargs)
+        return result if len(result) == 3 else (None,) + tuple(result)
+    return wrapper
+
+
+def run(layout_name, scan_fields, sheet_config, samples):
+    """
+    Decodes every (encoded image, truth) sample with a layout from whichever scanners package comes first on the
+    path, which for scanner_benchmark --baseline is an older commit's, so nothing else from this tree is imported.
+    Returns the number that failed, the total seconds spent scanning and finding the scan area, and how many times
+    each field was read correctly.
+    """
+    cv2.findContours = _opencv3_find_contours(cv2.findContours)
+    layout = getattr(import_module(LAYOUT_MODULES[layout_name]), layout_name)
+    img_dir = tempfile.mkdtemp()
+    kwargs = {'headless': True} if 'headless' in inspect.signature(layout.__init__).parameters else {}
+    scanner = layout(scan_fields, sheet_config, img_dir + "/", **kwargs)
+
+    crop_area = scanner._crop_scan_area
+    crop_seconds = [0.0]
+
+    def timed_crop_area(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return crop_area(*args, **kwargs)
+        finally:
+            crop_seconds[0] += time.perf_counter() - start
+    scanner._crop_scan_area = timed_crop_area
+
+    failed = 0
+    seconds = 0.0
+    correct = OrderedDict((key, 0) for key in samples[0][1].keys()) if samples else OrderedDict()
+    try:
+        for encoded, truth in samples:
+            img = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+            start = time.perf_counter()
+            try:
+                data = scanner.scan_sheet(img)[0]
+            except Exception as ex:
+                print("{} failed to scan a sheet: {}".format(layout_name, repr(ex)))
+                data = {}
+                failed += 1
+            seconds += time.perf_counter() - start
+            for key, value in truth.items():
+                correct[key] += data.get(key) == value
+        if hasattr(scanner, 'flush_images'):
+            scanner.flush_images()
+    finally:
+        shutil.rmtree(img_dir, ignore_errors=True)
+    return failed, seconds, crop_seconds[0], correct
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as job_file:
+        job = pickle.load(job_file)
+    with open(sys.argv[2], 'wb') as result_file:
+        pickle.dump(run(*job), result_file)
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from scanners.template import get_template
+
+
+class SheetRenderer(object):
+    """
+    Draws filled-in sheets for a fields list and sheet config, laid out the way a scanner layout reads them, along
+    with the data a perfect scan of each sheet decodes to.
+    """
+
+    PAPER_COLOUR = (255, 255, 255)
+    INK_COLOUR = (40, 40, 40)
+
+    def __init__(self, scan_fields, sheet_config, layout, dpi=200):
+        self.template = get_template(scan_fields, sheet_config, layout)
+        self.layout = layout
+        self.dpi = dpi
+        self.size = (int(layout.SHEET_WIDTH * dpi), int(layout.SHEET_HEIGHT * dpi))
+        self._rects = self.template.pixel_rects(*self.size)
+        self._blank = self._draw_blank()
+
+    def _draw_blank(self):
+        config = self.template.config
+        width, height = self.size
+        img = np.full((height, width, 3), self.PAPER_COLOUR, np.uint8)
+
+        marker_colour = tuple(reversed(config["marker_colour"]))  # RGB to BGR
+        x_factor, y_factor = self.template.xy_factors(width, height)
+        for x, y, w, h in self.layout.marker_boxes(config):
+            pt1 = (int(round(x * x_factor)), int(round(y * y_factor)))
+            pt2 = (int(round((x + w) * x_factor)) - 1, int(round((y + h) * y_factor)) - 1)
+            cv2.rectangle(img, pt1, pt2, marker_colour, -1)
+
+        outline_colour = tuple(reversed(config.get("font_color", [100, 100, 150])))
+        for x, y, w, h in self._rects.tolist():
+            cv2.rectangle(img, (x, y), (x + w, y + h), outline_colour, 1)
+        for plan in self.template.plans:
+            if plan.type == "Image":
+                pt1, pt2 = self.template.pixel_image_rect(plan, width, height)
+                cv2.rectangle(img, pt1, pt2, outline_colour, 1)
+        return img
+
+    def render(self, rng):
+        """
+        Draws a sheet filled in with random values, returning the image and the data it should decode to.
+        """
+        width, height = self.size
+        img = self._blank.copy()
+        truth = OrderedDict()
+        for plan in self.template.plans:
+            if plan.type == "Markers":
+                continue
+            if plan.type == "Image":
+                drawn = rng.rand() < 0.5
+                if drawn:
+                    self._scribble(img, self.template.pixel_image_rect(plan, width, height), rng)
+                truth[plan.id] = str(drawn)
+                continue
+            value, marks = self._random_field(plan, rng)
+            truth[plan.id] = value
+            for x, y, w, h in self._rects[plan.start:plan.stop][marks].tolist():
+                inset_x, inset_y = int(w * rng.uniform(0, 0.15)), int(h * rng.uniform(0, 0.15))
+                cv2.rectangle(img, (x + inset_x, y + inset_y), (x + w - inset_x, y + h - inset_y), self.INK_COLOUR, -1)
+
+        if "encoded_match_data" in truth:
+            encoded = truth.pop("encoded_match_data")
+            truth["match"] = int("0" + encoded[0:-1])
+            truth["pos"] = int("0" + encoded[-1])
+        return img, truth
+
+    def _random_field(self, plan, rng):
+        """
+        Picks a random value for a field, returning it with a mask of the boxes to fill in to encode it.
+        """
+        field = plan.field
+        marks = np.zeros(plan.stop - plan.start, dtype=bool)
+        if plan.type == "Digits":
+            digits = rng.randint(10, size=len(marks) // 7)
+            marks[:] = np.array([self.layout.NUMBERS_MODEL[d] for d in digits]).ravel()
+            return "".join(map(str, digits)), marks
+        elif plan.type == "Barcode":
+            if plan.id == "encoded_match_data":
+                value = rng.randint(1, min(2 ** len(marks) // 10, 150)) * 10 + rng.randint(len(self.layout.POSITIONS))
+            else:
+                value = rng.randint(2 ** len(marks))
+            marks[:] = (value >> np.arange(len(marks))) & 1
+            return str(value), marks
+        elif plan.type == "BoxNumber":
+            digits = rng.randint(10, size=field["options"]["digits"])
+            marks[np.arange(len(digits)) * 10 + digits] = True
+            return int("".join(map(str, digits))), marks
+        elif plan.type in ["HorizontalOptions", "Numbers", "Boolean"]:
+            options = field["options"]["options"]
+            data_type = field["options"]["type"]
+            if data_type == "Boolean":
+                marks[0] = rng.rand() < 0.5
+                return int(marks[0]), marks
+            elif data_type == "Numbers":
+                units = [i for i, option in enumerate(options) if "+" not in option]
+                tens = [i for i, option in enumerate(options) if "+" in option]
+                tens = tens[:rng.randint(len(tens) + 1)]
+                unit = rng.randint(len(units) + 1) - 1
+                total = sum(int(options[i].strip("+")) for i in tens)
+                marks[tens] = True
+                if unit >= 0:
+                    marks[units[unit]] = True
+                    total += int(options[units[unit]])
+                return total, marks
+            else:
+                choice = rng.randint(len(options) + 1)
+                if choice == len(options):
+                    return "", marks
+                marks[choice] = True
+                return options[choice][0] if type(options[choice]) == list else options[choice], marks
+        elif plan.type == "BulkOptions":
+            headers = field["options"]["headers"]
+            options = field["options"]["options"]
+            marks[:] = rng.rand(len(marks)) < 0.3
+            return {header: [options[k] for k in range(len(options)) if marks[i * len(options) + k]]
+                    for i, header in enumerate(headers)}, marks
+        raise ValueError("Can't render {} fields".format(plan.type))
+
+    def _scribble(self, img, corners, rng):
+        (x1, y1), (x2, y2) = corners
+        points = np.stack([rng.randint(x1 + 5, x2 - 5, 12), rng.randint(y1 + 5, y2 - 5, 12)], axis=1)
+        cv2.polylines(img, [points.astype(np.int32)], False, self.INK_COLOUR, thickness=max(2, self.dpi // 60))
+
+
+def distort(img, rng, rotation=0.0, skew=0.0, blur=0.0, jpeg_quality=None, noise=0.0, margin=0.05, upside_down=0.0):
+    """
+    Simulates scanning a printed sheet. The sheet is laid on a scanner bed margin times its size bigger on each side,
+    rotated by up to rotation degrees, turned upside down with a probability of upside_down and its corners moved by up
+    to skew times its size, then it's blurred with a Gaussian of sigma blur pixels, given Gaussian noise with a
+    standard deviation of noise grey levels and finally JPEG compressed at jpeg_quality.
+    """
+    height, width = img.shape[:2]
+    pad_x, pad_y = int(width * margin), int(height * margin)
+    bed_size = (width + 2 * pad_x, height + 2 * pad_y)
+
+    src = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    angle = np.radians(rng.uniform(-rotation, rotation))
+    if upside_down and rng.uniform() < upside_down:
+        angle += np.pi
+    rotate = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    centre = np.array([width / 2.0, height / 2.0])
+    dst = (src - centre).dot(rotate.T) + centre + (pad_x, pad_y)
+    dst += rng.uniform(-skew, skew, (4, 2)) * (width, height)
+    warp_matrix = cv2.getPerspectiveTransform(src, dst.astype(np.float32))
+    img = cv2.warpPerspective(img, warp_matrix, bed_size, borderMode=cv2.BORDER_CONSTANT,
+                              borderValue=(250, 250, 250))
+
+    if blur:
+        img = cv2.GaussianBlur(img, (0, 0), blur)
+    if noise:
+        img = np.clip(img + rng.normal(0, noise, img.shape), 0, 255).astype(np.uint8)
+    if jpeg_quality is not None:
+        img = cv2.imdecode(cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)])[1],
+                           cv2.IMREAD_COLOR)
+    return img
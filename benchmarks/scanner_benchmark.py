@@ -0,0 +1,161 @@
+import argparse
+import io
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from collections import OrderedDict, namedtuple
+
+import cv2
+import numpy as np
+
+from benchmarks.render import SheetRenderer, distort
+from scanners.legacy import LegacyScanner
+from scanners.scanner import Scanner
+from scanners.timing import ScanStats
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['layout', 'sheets', 'failed', 'seconds', 'stage_ms', 'field_accuracy'])
+
+LAYOUTS = OrderedDict([('Scanner', Scanner), ('LegacyScanner', LegacyScanner)])
+
+
+def load_sheet_files(fields_file, config_file):
+    scan_fields = json.load(open(fields_file))
+    sheet_config = json.load(open(config_file))
+    # Configs from before barcode_spacing existed can't be laid out; the value only has to agree between the renderer
+    # and the scanner here.
+    sheet_config.setdefault("barcode_spacing", sheet_config["box_spacing"])
+    return scan_fields, sheet_config
+
+
+def render_samples(renderer, num_sheets, seed, **distortions):
+    rng = np.random.RandomState(seed)
+    samples = []
+    for _ in range(num_sheets):
+        img, truth = renderer.render(rng)
+        samples.append((distort(img, rng, **distortions), truth))
+    return samples
+
+
+def run_benchmark(layout, scan_fields, sheet_config, samples):
+    """
+    Decodes every (image, truth) sample with a headless scanner, timing each stage and counting how often each field
+    is read correctly.
+    """
+    img_dir = tempfile.mkdtemp()
+    scanner = layout(scan_fields, sheet_config, img_dir + "/", headless=True)
+    stats = ScanStats(window=max(len(samples), 1))
+    scanner.set_stats(stats)
+
+    failed = 0
+    seconds = 0.0
+    correct = OrderedDict((key, 0) for key in samples[0][1].keys()) if samples else OrderedDict()
+    try:
+        for img, truth in samples:
+            start = time.perf_counter()
+            try:
+                data, marked_sheet = scanner.scan_sheet(img)
+            except Exception as ex:
+                print("{} failed to scan a sheet: {}".format(layout.__name__, repr(ex)))
+                data = {}
+                failed += 1
+            seconds += time.perf_counter() - start
+            for key, value in truth.items():
+                correct[key] += data.get(key) == value
+        scanner.flush_images()
+    finally:
+        shutil.rmtree(img_dir, ignore_errors=True)
+
+    field_accuracy = OrderedDict((key, count / float(len(samples))) for key, count in correct.items())
+    return BenchmarkResult(layout.__name__, len(samples), failed, seconds, stats.summary(), field_accuracy)
+
+
+def run_baseline(ref, layout, scan_fields, sheet_config, samples):
+    """
+    Decodes the same samples with a layout's scanner as it was at a git commit, so a change can be compared with
+    the implementation it replaced. That commit's scanners package is checked out into a temporary directory and run
+    in a child process. Only the total scan time and the time spent finding the scan area can be measured there.
+    """
+    workdir = tempfile.mkdtemp()
+    try:
+        archive = subprocess.check_output(['git', 'archive', ref, 'scanners'])
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(workdir)
+        encoded = [(cv2.imencode('.png', img)[1], truth) for img, truth in samples]  # Lossless, and much smaller.
+        job_path, result_path = os.path.join(workdir, 'job.pickle'), os.path.join(workdir, 'result.pickle')
+        with open(job_path, 'wb') as job_file:
+            pickle.dump((layout.__name__, scan_fields, sheet_config, encoded), job_file)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([workdir] + [path for path in [env.get('PYTHONPATH')] if path])
+        subprocess.check_call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'baseline.py'), job_path, result_path],
+                              cwd=workdir, env=env)
+        with open(result_path, 'rb') as result_file:
+            failed, seconds, crop_seconds, correct = pickle.load(result_file)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    sheets = max(len(samples), 1)
+    stage_ms = OrderedDict([("scan", 1000 * seconds / sheets), ("crop", 1000 * crop_seconds / sheets)])
+    field_accuracy = OrderedDict((key, count / float(sheets)) for key, count in correct.items())
+    return BenchmarkResult("{}@{}".format(layout.__name__, ref), len(samples), failed, seconds, stage_ms,
+                           field_accuracy)
+
+
+def print_report(results):
+    for result in results:
+        sheets_per_second = result.sheets / result.seconds if result.seconds else 0
+        print("{}: {} sheets, {:.2f} sheets/s, {} failed".format(result.layout, result.sheets, sheets_per_second,
+                                                                result.failed))
+        for stage, ms in result.stage_ms.items():
+            print("  {:<28} {:8.1f} ms/sheet".format(stage, ms))
+    print("")
+    widths = [max(15, len(result.layout) + 2) for result in results]
+    print("{:<24}".format("field") + "".join("{:>{}}".format(result.layout, width)
+                                             for result, width in zip(results, widths)))
+    for key in results[0].field_accuracy.keys():
+        print("{:<24}".format(key) + "".join("{:>{}.1f}%".format(100 * result.field_accuracy.get(key, 0), width - 1)
+                                             for result, width in zip(results, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure scanner speed and accuracy on synthetic sheets.')
+    parser.add_argument('--fields', default='steamworks_fields.json')
+    parser.add_argument('--config', default='steamworks_config.json')
+    parser.add_argument('--layouts', nargs='+', default=list(LAYOUTS.keys()), choices=list(LAYOUTS.keys()))
+    parser.add_argument('--sheets', type=int, default=20)
+    parser.add_argument('--dpi', type=int, default=200, help='resolution the sheets are rendered at')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rotation', type=float, default=1.0, help='max rotation in degrees')
+    parser.add_argument('--skew', type=float, default=0.005, help='max corner offset as a fraction of the sheet')
+    parser.add_argument('--blur', type=float, default=1.0, help='Gaussian blur sigma in pixels')
+    parser.add_argument('--noise', type=float, default=8.0, help='noise standard deviation in grey levels')
+    parser.add_argument('--jpeg-quality', type=int, default=85, help='0 to skip JPEG compression')
+    parser.add_argument('--upside-down', type=float, default=0.0, help='fraction of sheets scanned upside down')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=JSON',
+                        help='override a sheet config value for the scanners, e.g. --set roi_warp=true')
+    parser.add_argument('--baseline', default=None, metavar='COMMIT',
+                        help='also run the same sheets through the scanners as they were at a git commit')
+    args = parser.parse_args()
+
+    fields, config = load_sheet_files(args.fields, args.config)
+    scanner_config = dict(config)
+    for setting in args.set:
+        key, value = setting.split('=', 1)
+        scanner_config[key] = json.loads(value)
+    benchmark_results = []
+    for name in args.layouts:
+        sheet_renderer = SheetRenderer(fields, config, LAYOUTS[name], args.dpi)
+        sheet_samples = render_samples(sheet_renderer, args.sheets, args.seed, rotation=args.rotation,
+                                       skew=args.skew, blur=args.blur, noise=args.noise,
+                                       jpeg_quality=args.jpeg_quality or None, upside_down=args.upside_down)
+        benchmark_results.append(run_benchmark(LAYOUTS[name], fields, scanner_config, sheet_samples))
+        if args.baseline:
+            benchmark_results.append(run_baseline(args.baseline, LAYOUTS[name], fields, scanner_config,
+                                                  sheet_samples))
+    print_report(benchmark_results)
@@ -0,0 +1,144 @@
+import json
+import sqlite3
+import time
+from threading import Lock
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS scouting_entries ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT NOT NULL, team INTEGER NOT NULL, match INTEGER NOT NULL, '
+    'pos INTEGER NOT NULL, filename TEXT, data TEXT NOT NULL, last_modified REAL NOT NULL)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS scouting_entries_slot ON scouting_entries (event, match, pos)',
+    'CREATE INDEX IF NOT EXISTS scouting_entries_team ON scouting_entries (event, team)',
+    'CREATE INDEX IF NOT EXISTS scouting_entries_event ON scouting_entries (event, last_modified)',
+]
+
+COLUMNS = ['id', 'event', 'team', 'match', 'pos', 'filename', 'data', 'last_modified']
+
+MAX_QUERY_PARAMS = 500
+
+
+class ScoutingDatabase(object):
+    """
+    The scouting_entries table of a local db.sqlite, written as sheets are submitted so the spreadsheet doesn't have
+    to wait for Clooney. There's one entry per event, match and position: submitting a sheet for a slot that's
+    already filled replaces the entry in it.
+
+    A scouting_entries table made by something else, such as one synced from Clooney, can still be read as long as
+    it has event and data columns, whatever else it has. It's never changed though: if its columns aren't exactly
+    COLUMNS, or it already holds more than one entry for a slot, read_only says why and writing to it raises
+    sqlite3.DatabaseError. A table without event and data columns raises sqlite3.DatabaseError when opened.
+
+    Reads for the spreadsheet are parameterized queries on the one connection, whose prepared statements sqlite3
+    reuses. Decoded entries are cached by rowid and last_modified, so each read only decodes the rows written since
+    the one before. Finding those rows only reads the (event, last_modified) index. A table without a last_modified
+    column is stamped with the data itself instead.
+    """
+
+    def __init__(self, db_path):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = Lock()
+        self._entries = {}
+        self._teams = (None, None)
+        self.read_only = None
+        try:
+            with self._lock, self._db:
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute(SCHEMA[0])
+                columns = [row[1] for row in self._db.execute('PRAGMA table_info(scouting_entries)')]
+                missing = [column for column in ('event', 'data') if column not in columns]
+                if missing:
+                    raise sqlite3.DatabaseError("The scouting_entries table in {} has no {} column"
+                                                .format(db_path, ' or '.join(missing)))
+                self._stamp_column = 'last_modified' if 'last_modified' in columns else 'data'
+                if columns != COLUMNS:
+                    self.read_only = "The scouting_entries table in {} has columns {}, not {}".format(
+                        db_path, columns, COLUMNS)
+            if self.read_only is None:
+                with self._lock, self._db:
+                    for statement in SCHEMA[1:]:
+                        self._db.execute(statement)
+        except sqlite3.IntegrityError as ex:  # More than one entry for a slot.
+            self.read_only = "The scouting_entries table in {} can't be indexed: {}".format(db_path, ex)
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def _check_writable(self):
+        if self.read_only is not None:
+            raise sqlite3.DatabaseError(self.read_only)
+
+    def upsert_entry(self, event, entry):
+        """
+        Writes a submitted entry into its slot. Returns the filename of the entry it replaced, or None if the slot
+        was empty.
+        """
+        return self.upsert_entries(event, [entry])[0]
+
+    def upsert_entries(self, event, entries):
+        """
+        Writes entries into their slots in one transaction, so there's one commit however many there are. Returns
+        the filename each one replaced, or None where the slot was empty. Rows are updated in place rather than with
+        an upsert, which needs SQLite 3.24.
+        """
+        rows = [(int(entry["team_number"]), entry.get("filename"), json.dumps(entry), time.time(), event,
+                 int(entry["match"]), int(entry["pos"])) for entry in entries]
+        replaced = []
+        self._check_writable()
+        with self._lock, self._db:
+            for values in rows:
+                row = self._db.execute('SELECT filename FROM scouting_entries '
+                                       'WHERE event = ? AND match = ? AND pos = ?', values[4:]).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE scouting_entries SET team = ?, filename = ?, data = ?, '
+                                     'last_modified = ? WHERE event = ? AND match = ? AND pos = ?', values)
+                else:
+                    self._db.execute('INSERT INTO scouting_entries (team, filename, data, last_modified, event, '
+                                     'match, pos) VALUES (?, ?, ?, ?, ?, ?, ?)', values)
+                replaced.append(row[0] if row is not None else None)
+        return replaced
+
+    def delete_entry(self, event, filename):
+        self._check_writable()
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM scouting_entries WHERE event = ? AND filename = ?', (event, filename))
+
+    def event_entries(self, event):
+        """
+        Every entry of an event decoded, in the order they were first written. The entries are shared with later
+        calls, so they mustn't be changed.
+        """
+        return [entry for row_id, stamp, entry in self.event_entry_rows(event)]
+
+    def event_entry_rows(self, event):
+        """
+        The (rowid, last_modified, entry) of every entry of an event, like event_entries. For a table without
+        last_modified it's the entry's text.
+        """
+        with self._lock:
+            stamps = self._db.execute('SELECT rowid, {} FROM scouting_entries WHERE event = ? ORDER BY rowid'
+                                      .format(self._stamp_column), (event,)).fetchall()
+            self._entries = {row_id: self._entries[row_id] for row_id, stamp in stamps if row_id in self._entries}
+            changed = [row_id for row_id, stamp in stamps if self._entries.get(row_id, (None,))[0] != stamp]
+            for start in range(0, len(changed), MAX_QUERY_PARAMS):
+                chunk = changed[start:start + MAX_QUERY_PARAMS]
+                rows = self._db.execute('SELECT rowid, {}, data FROM scouting_entries WHERE rowid IN ({})'
+                                        .format(self._stamp_column, ', '.join('?' * len(chunk))), chunk)
+                for row_id, stamp, data in rows:
+                    self._entries[row_id] = (stamp, json.loads(data))
+            return [(row_id,) + self._entries[row_id] for row_id, stamp in stamps if row_id in self._entries]
+
+    def event_teams(self, event):
+        """
+        The team list of an event from the events table, only decoded again if it changed.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM events WHERE id = ?', (event,)).fetchone()
+            if row is None:
+                raise KeyError("No event {} in the database".format(event))
+            if row[2] != self._teams[0]:
+                self._teams = (row[2], json.loads(row[2]))
+            return self._teams[1]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
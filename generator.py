@@ -1,25 +1,32 @@
+import hashlib
 import json
-import sqlite3
+import os
+from io import BytesIO
 
 import xlsxwriter
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
 
+from database import ScoutingDatabase
+from sheet_parts import SheetPartCache
 from tba_py import TBA
 
 
 class SpreadsheetGenerator:
     def __init__(self, db_path, tba):
         self.db_path = db_path
+        self.database = ScoutingDatabase(db_path)
+        self.sheet_parts = SheetPartCache()
         self.tba = tba
 
         self.workbook = None
         self.formats = None
         self.headers = None
-        self.event = None
         self.raw_entries = None
         self.teams = None
         self.matches = None
+        self.defined_names = []
+        self.last_filename = None
 
         self.page_names = {
             'raw':                  'raw_data',
@@ -53,15 +60,15 @@ class SpreadsheetGenerator:
         }
 
     def create_spreadsheet_for_event(self, event_id, filename='Clooney.xlsx'):
-        self.workbook = xlsxwriter.Workbook(filename)
-        self.formats = dict([(k, self.workbook.add_format(v)) for k, v in self.raw_formats.items()])
-
-        db = sqlite3.connect(self.db_path)
+        """
+        Builds the spreadsheet for an event. Only the sheets drawn from entries, teams or matches that changed since
+        the last build are drawn again, and of the sheets with a row per entry only the rows that changed. The rest
+        are put back from the last build. Returns False without writing anything if nothing changed.
+        """
         self.headers = json.load(open('headers.json'))
-        self.event = db.execute('SELECT * FROM events WHERE id = "{}"'.format(event_id)).fetchone()
-        self.raw_entries = [json.loads(e[-2]) for e in
-                            db.execute('SELECT * FROM scouting_entries WHERE event = "{}"'.format(event_id)).fetchall()]
-        self.teams = sorted(json.loads(self.event[2]), key=lambda x: int(x['team_number']))
+        entry_rows = self.database.event_entry_rows(event_id)
+        self.raw_entries = [entry for row_id, stamp, entry in entry_rows]
+        self.teams = sorted(self.database.event_teams(event_id), key=lambda x: int(x['team_number']))
         self.matches = sorted([e for e in self.tba.get_event_matches(event_id) if e['comp_level'] == 'qm'],
                               key=lambda x: x['match_number'])
         for match in self.matches:
@@ -69,23 +76,74 @@ class SpreadsheetGenerator:
                 for i in range(3):
                     match[alli + '_' + str(i + 1)] = int(match['alliances'][alli]['team_keys'][i][3:])
 
-        self.draw_pretty_analysis()
-        self.draw_pretty_match_rundown()
-        self.draw_pretty_team_stats()
-        self.draw_pretty_team_schedule()
-        self.draw_pretty_schedule()
-        self.draw_pretty_team_list()
-        self.draw_pretty_raw_data()
-
-        self.draw_raw_data()
-        self.draw_raw_calculated()
-        self.draw_raw_analysis()
-        self.draw_raw_team_list()
-        self.draw_raw_schedule()
-        self.draw_raw_team_matches()
+        layout = self._signature([event_id, self.raw_formats, self.headers])
+        teams = self._signature(self.teams)
+        matches = self._signature(self.matches)
+        entry_keys = [(row_id, stamp) for row_id, stamp, entry in entry_rows]
+        entry_count = [None] * len(entry_rows)  # Rows that only depend on how many entries there are.
+        sections = [  # (page, draw function, signature, row keys), in the order the sheets go in the workbook.
+            ('pretty_analysis', self.draw_pretty_analysis, (layout, teams), None),
+            ('match_rundown', self.draw_pretty_match_rundown, (layout, teams), None),
+            ('team_stats', self.draw_pretty_team_stats, (layout, teams), None),
+            ('pretty_team_schedule', self.draw_pretty_team_schedule, (layout, teams), None),
+            ('pretty_matches', self.draw_pretty_schedule, (layout, matches), None),
+            ('pretty_team_list', self.draw_pretty_team_list, (layout, teams), None),
+            ('pretty_raw', self.draw_pretty_raw_data, (layout,), entry_count),
+            ('raw', self.draw_raw_data, (layout,), entry_keys),
+            ('raw_calculated', self.draw_raw_calculated, (layout,), entry_count),
+            ('raw_analysis', self.draw_raw_analysis, (layout, teams), None),
+            ('raw_team_list', self.draw_raw_team_list, (layout, teams), None),
+            ('raw_matches', self.draw_raw_schedule, (layout, matches), None),
+            ('raw_team_schedule', self.draw_raw_team_matches, (layout, teams), None),
+        ]
+
+        self.sheet_parts.start()
+        plans = [self.sheet_parts.plan(page, index, signature, row_keys)
+                 for index, (page, draw, signature, row_keys) in enumerate(sections)]
+        if self.sheet_parts.all_whole() and filename == self.last_filename and os.path.exists(filename):
+            return False
+
+        output = BytesIO()
+        self.workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        self.formats = dict([(k, self.workbook.add_format(v)) for k, v in self.raw_formats.items()])
+        for workbook_format in self.formats.values():
+            # Sheets put back from the last build point at its style indices, so every build hands them out in the
+            # same order before anything is drawn.
+            workbook_format._get_xf_index()
+            workbook_format._get_dxf_index()
+
+        for (page, draw, signature, row_keys), (whole, kept_rows) in zip(sections, plans):
+            names, hidden, dynamic_arrays = self.sheet_parts.kept_sheet(page)
+            if whole:
+                sheet = self.workbook.add_worksheet(self.page_names[page])
+                if hidden:
+                    sheet.hide()
+                for name, formula in names:
+                    self.define_name(name, formula)
+            else:
+                self.defined_names = []
+                if row_keys is None:
+                    draw()
+                else:
+                    draw(first_row=kept_rows)
+                sheet = self.workbook.worksheets()[-1]
+                self.sheet_parts.drawn(page, self.defined_names, bool(sheet.hidden))
+            if dynamic_arrays:
+                sheet.has_dynamic_arrays = True  # So the workbook gets the metadata part the kept cells point at.
 
         self.workbook.close()
         self.workbook = None
+        self.sheet_parts.assemble(output.getvalue(), filename)
+        self.last_filename = filename
+        return True
+
+    @staticmethod
+    def _signature(value):
+        return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+    def define_name(self, name, formula):
+        self.workbook.define_name(name, formula)
+        self.defined_names.append((name, formula))
 
     @staticmethod
     def next_col(col, i=1):
@@ -100,16 +158,16 @@ class SpreadsheetGenerator:
         return "".join(col)
 
     def name_col(self, name, page, col, num_rows=999, start_row=1):
-        self.workbook.define_name(name, "='{0}'!{1}{3}:{1}{2}".format(page, col, num_rows + start_row, start_row))
+        self.define_name(name, "='{0}'!{1}{3}:{1}{2}".format(page, col, num_rows + start_row, start_row))
 
     def name_range(self, name, page, start_row=None, start_col='A', end_col='Z', end_row=None):
         range_str = "='{0}'!{1}{3}:{2}{4}".format(page, start_col, end_col,
                                                   start_row if start_row is not None else "",
                                                   (end_row if end_row is not None else start_row)
                                                   if start_row is not None else "")
-        self.workbook.define_name(name, range_str)
+        self.define_name(name, range_str)
 
-    def draw_raw_data(self):
+    def draw_raw_data(self, first_row=0):
         page_name = self.page_names['raw']
         headers = self.headers['raw']
         sheet = self.workbook.add_worksheet(page_name)
@@ -125,13 +183,13 @@ class SpreadsheetGenerator:
             header_cols[header['key']] = col
             col = self.next_col(col)
 
-        for i in range(data_len):
+        for i in range(first_row, data_len):
             for header in headers:
                 col = header_cols[header['key']]
                 val = self.raw_entries[i][header['key']]
                 sheet.write(self.get_cell(col, i + 2), val, self.formats['raw_data_cell'])
 
-    def draw_raw_calculated(self):
+    def draw_raw_calculated(self, first_row=0):
         page_name = self.page_names['raw_calculated']
         headers = self.headers['raw_calculated']
         sheet = self.workbook.add_worksheet(page_name)
@@ -142,7 +200,7 @@ class SpreadsheetGenerator:
         for header in headers:
             sheet.write(self.get_cell(col, 1), header['title'])
             self.name_col('raw_calculated_{}'.format(header['key']), page_name, col, data_len + 1)
-            for i in range(data_len):
+            for i in range(first_row, data_len):
                 sheet.write(self.get_cell(col, i + 2), header['value'], self.formats['raw_data_cell'])
             col = self.next_col(col)
 
@@ -236,12 +294,12 @@ class SpreadsheetGenerator:
                 sheet.write(self.get_cell(col, i + 2), self._get_data(self.matches[i], header['key']),
                             self.formats['raw_data_cell'])
             col = self.next_col(col)
-        self.workbook.define_name(
+        self.define_name(
                 'schedule_match_teams',
                 "='{0}'!{1}:{2}".format(page_name, red_1_col, blue_3_col)
         )
 
-    def draw_pretty_raw_data(self):
+    def draw_pretty_raw_data(self, first_row=0):
         page_name = self.page_names['pretty_raw']
         raw_headers = self.headers['raw']
         calc_headers = self.headers['raw_calculated']
@@ -256,7 +314,7 @@ class SpreadsheetGenerator:
                     header['title'],
                     self.formats[header['header_format'] if 'header_format' in header.keys() else 'pretty_header']
             )
-            for i in range(data_len):
+            for i in range(first_row, data_len):
                 val = '=raw_{}'.format(header['key'])
                 sheet.write(self.get_cell(col, i + 2), val, self.formats[header['format'] if 'format' in header.keys() else 'pretty_data_cell'])
             col = self.next_col(col)
@@ -267,7 +325,7 @@ class SpreadsheetGenerator:
                     header['title'],
                     self.formats[header['header_format'] if 'header_format' in header.keys() else 'pretty_header']
             )
-            for i in range(data_len):
+            for i in range(first_row, data_len):
                 val = '=raw_calculated_{}'.format(header['key'])
                 sheet.write(self.get_cell(col, i + 2), val, self.formats[header['format'] if 'format' in header.keys() else 'pretty_data_cell'])
             col = self.next_col(col)
@@ -715,9 +773,8 @@ class SpreadsheetGenerator:
 
 
 if __name__ == "__main__":
-    db = sqlite3.connect('/Users/kestin/db.sqlite')
     tba = TBA('GdZrQUIjmwMZ3XVS622b6aVCh8CLbowJkCs5BmjJl2vxNuWivLz3Sf3PaqULUiZW')
     filename = '/Users/kestin/Google Drive/Scouting/Clooney.xlsx'
-    gen = SpreadsheetGenerator(db, tba)
-    gen.create_spreadsheet_for_event('2018onham', filename=filename)
-    gen.upload_to_google_drive(filename)
+    gen = SpreadsheetGenerator('/Users/kestin/db.sqlite', tba)
+    if gen.create_spreadsheet_for_event('2018onham', filename=filename):
+        gen.upload_to_google_drive(filename)
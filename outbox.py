@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import time
+from threading import Event, Lock, Thread
+
+import requests
+
+
+class UploadOutbox(object):
+    """
+    Entries waiting to be posted to Clooney, kept in a SQLite table so nothing queued is lost if the upload fails or
+    the scanner is closed. One worker thread drains the queue oldest first through a single requests.Session, so
+    uploads reuse one kept-alive connection. Whatever is queued when a batch is taken goes out back to back and is
+    removed from the table in one commit. After a failed upload the worker waits, twice as long after each failure
+    in a row, before trying again. Entries queued before a restart are sent when the next outbox starts on the file.
+    """
+
+    def __init__(self, db_path, url, batch_size=20, timeout=10.0, min_backoff=1.0, max_backoff=300.0):
+        self.url = url
+        self._batch_size = batch_size
+        self._timeout = timeout
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, queued REAL, '
+                         'payload TEXT)')
+        self._db.commit()
+        self._lock = Lock()
+        self._session = requests.Session()
+        self._wake = Event()
+        self._closed = Event()
+        self.last_error = None
+        self._thread = Thread(target=self._work, name="UploadOutbox")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, payload):
+        with self._lock:
+            self._db.execute('INSERT INTO outbox (queued, payload) VALUES (?, ?)', (time.time(), json.dumps(payload)))
+            self._db.commit()
+        self._wake.set()
+
+    def status(self):
+        """
+        The number of entries waiting and how many seconds the oldest of them has been waiting, 0 if there are none.
+        """
+        with self._lock:
+            depth, oldest = self._db.execute('SELECT COUNT(*), MIN(queued) FROM outbox').fetchone()
+        return depth, time.time() - oldest if oldest is not None else 0.0
+
+    def status_text(self):
+        depth, lag = self.status()
+        if not depth:
+            return "Uploads up to date"
+        text = "{} upload{} waiting, oldest {:.0f}s".format(depth, "" if depth == 1 else "s", lag)
+        if self.last_error is not None:
+            text += " ({})".format(self.last_error)
+        return text
+
+    def _take_batch(self):
+        with self._lock:
+            return self._db.execute('SELECT id, payload FROM outbox ORDER BY id LIMIT ?',
+                                    (self._batch_size,)).fetchall()
+
+    def _send(self, payload):
+        """
+        Posts one entry. Returns True if it's done with, False if it should be tried again later.
+        """
+        try:
+            response = self._session.post(self.url, json=json.loads(payload), timeout=self._timeout)
+        except requests.RequestException as ex:
+            self.last_error = ex.__class__.__name__
+            print(ex)
+            return False
+        if response.status_code >= 500 or response.status_code in (408, 429):
+            self.last_error = "HTTP {}".format(response.status_code)
+            print("Clooney upload failed: HTTP {}".format(response.status_code))
+            return False
+        if response.status_code >= 400:  # Sending it again won't help, it's still in the local results.
+            print("Clooney rejected an entry: HTTP {} {}".format(response.status_code, payload))
+        self.last_error = None
+        return True
+
+    def _work(self):
+        backoff = 0.0
+        while not self._closed.is_set():
+            batch = self._take_batch()
+            if not batch:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            done = []
+            for row_id, payload in batch:
+                if self._closed.is_set() or not self._send(payload):
+                    break
+                done.append(row_id)
+            if done:
+                with self._lock:
+                    self._db.executemany('DELETE FROM outbox WHERE id = ?', [(row_id,) for row_id in done])
+                    self._db.commit()
+            if len(done) < len(batch):
+                backoff = min(max(backoff * 2, self._min_backoff), self._max_backoff)
+                self._closed.wait(backoff)
+            else:
+                backoff = 0.0
+
+    def close(self, timeout=5.0):
+        """
+        Stops the worker, leaving anything not yet sent queued for next time.
+        """
+        self._closed.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._session.close()
+        if not self._thread.is_alive():
+            with self._lock:
+                self._db.close()
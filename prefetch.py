@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from scanners.timing import SheetTiming
+
+
+class ScanPrefetcher(object):
+    """
+    Decodes the next few pending scans on worker threads so they're ready by the time they're needed.
+    A prefetched result is only handed out if its file is still there and unchanged since it was read.
+    """
+
+    def __init__(self, scanner, depth=3, workers=2):
+        self._scanner = scanner
+        self._depth = depth
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._jobs = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _signature(filepath):
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _decode(self, filepath, signature):
+        timing = SheetTiming(os.path.basename(filepath))
+        with timing.stage("read"):
+            raw_scan = self._scanner.read_scan(filepath)
+        if raw_scan is None:
+            raise IOError("Failed to read " + filepath)
+        data, marked_sheet = self._scanner.scan_sheet(raw_scan, timing)
+        marked_sheet.render()
+        return signature, raw_scan, data, marked_sheet
+
+    def update(self, pending):
+        """
+        Takes the ordered list of scans waiting after the current one. Starts decoding the first few and drops jobs
+        for scans that have left the look-ahead window.
+        """
+        window = list(pending[:self._depth])
+        with self._lock:
+            for filepath in list(self._jobs.keys()):
+                if filepath not in window:
+                    self._jobs.pop(filepath).cancel()
+            for filepath in window:
+                if filepath not in self._jobs:
+                    signature = self._signature(filepath)
+                    if signature is not None:
+                        self._jobs[filepath] = self._executor.submit(self._decode, filepath, signature)
+
+    def take(self, filepath):
+        """
+        Returns (raw_scan, data, marked_sheet) for a prefetched scan, waiting for it if it's still decoding. Returns
+        None if it wasn't prefetched, failed to decode, or the file was moved, deleted or rewritten since.
+        """
+        with self._lock:
+            job = self._jobs.pop(filepath, None)
+        if job is None or job.cancelled():
+            return None
+        try:
+            signature, raw_scan, data, marked_sheet = job.result()
+        except Exception as ex:
+            print(ex)
+            return None
+        if signature != self._signature(filepath):
+            return None
+        return raw_scan, data, marked_sheet
+
+    def invalidate(self, filepath=None):
+        """
+        Drops the prefetched result for one scan, or for every scan if none is given (e.g. when the template changes).
+        """
+        with self._lock:
+            filepaths = list(self._jobs.keys()) if filepath is None else [filepath]
+            for path in filepaths:
+                job = self._jobs.pop(path, None)
+                if job is not None:
+                    job.cancel()
+
+    def shutdown(self):
+        self.invalidate()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+from threading import Lock
+
+
+class ResultStore(object):
+    """
+    Submitted entries kept one JSON object per line in an append-only file. The offset of every line is indexed when
+    the store is opened, so adding an entry is one append and taking back the last one is one truncate, however many
+    entries there are. Every change is fsynced before it returns. A line left half written by a crash is dropped the
+    next time the store is opened, so a crash loses at most the entry being written.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = Lock()
+        self._offsets = []
+        self._file = open(filepath, 'a+b')
+        self._index()
+
+    def _index(self):
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            if not line.endswith(b'\n'):
+                print("Dropping a partly written entry at the end of {}".format(self.filepath))
+                self._truncate(offset)
+                break
+            self._offsets.append(offset)
+            offset += len(line)
+
+    def _truncate(self, offset):
+        self._file.truncate(offset)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def append(self, entry):
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        with self._lock:
+            offset = self._file.seek(0, os.SEEK_END)
+            try:
+                self._file.write(line)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except (IOError, OSError):
+                self._truncate(offset)
+                raise
+            self._offsets.append(offset)
+
+    def last(self):
+        """
+        The last entry, or None if there are none.
+        """
+        with self._lock:
+            if not self._offsets:
+                return None
+            self._file.seek(self._offsets[-1])
+            return json.loads(self._file.readline().decode('utf-8'))
+
+    def pop(self):
+        """
+        Removes the last entry and returns it, or returns None if there are none.
+        """
+        with self._lock:
+            if not self._offsets:
+                return None
+            self._file.seek(self._offsets[-1])
+            entry = json.loads(self._file.readline().decode('utf-8'))
+            self._truncate(self._offsets.pop())
+            return entry
+
+    def entries(self):
+        with self._lock:
+            self._file.seek(0)
+            return [json.loads(self._file.readline().decode('utf-8')) for _ in self._offsets]
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def import_json_file(json_path, store):
+    """
+    Appends every entry of a data.json file written before the ResultStore existed. Returns how many were imported.
+    """
+    with open(json_path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        store.append(entry)
+    return len(entries)
+
+
+def open_result_store(data_filepath):
+    """
+    Opens the store for a data file path, which for a .json path is the .jsonl file next to it. The first time a
+    .jsonl store is made next to an existing .json file, the entries in it are imported. The .json file is left as
+    it was.
+    """
+    if not data_filepath.endswith('.json'):
+        return ResultStore(data_filepath)
+    store_path = data_filepath + 'l'
+    importing = not os.path.exists(store_path) and os.path.exists(data_filepath)
+    if not importing:
+        return ResultStore(store_path)
+    partial_path = store_path + '.importing'
+    if os.path.exists(partial_path):  # Left by an import that didn't finish.
+        os.remove(partial_path)
+    store = ResultStore(partial_path)
+    try:
+        count = import_json_file(data_filepath, store)
+    except ValueError as ex:
+        print("Couldn't import {}: {}".format(data_filepath, ex))
+        count = 0
+    finally:
+        store.close()
+    os.replace(partial_path, store_path)
+    print("Imported {} entries from {} into {}".format(count, data_filepath, store_path))
+    return ResultStore(store_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import the entries of a data.json file into a .jsonl result store.')
+    parser.add_argument('json_file')
+    parser.add_argument('store', nargs='?', default=None, help='defaults to the .jsonl file next to json_file')
+    args = parser.parse_args()
+
+    result_store = ResultStore(args.store or os.path.splitext(args.json_file)[0] + '.jsonl')
+    try:
+        print("Imported {} entries".format(import_json_file(args.json_file, result_store)))
+    finally:
+        result_store.close()
@@ -1,2 +1,3 @@
 from scanners.legacy import LegacyScanner
-from scanners.scanner import Scanner
\ No newline at end of file
+from scanners.scanner import Scanner
+from scanners.template import SheetTemplate, load_template
@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+import cv2
+
+BoxResult = namedtuple('BoxResult', ['field', 'kind', 'rect', 'value', 'filled', 'fill', 'margin'])
+FieldResult = namedtuple('FieldResult', ['id', 'type', 'value', 'margin'])
+
+
+class MarkedSheet(object):
+    """
+    A warped scan and everything read from it: every box with its fill ratio and margin of decision, the decoded
+    fields with their margins, the confidence in each decoded digit, the orientation it was read in (180 if the scan
+    was upside down) and, if it was timed, the sheet's SheetTiming.
+    The image can be given as a function that makes it, which is only called the first time it's needed.
+    The marked overlay is only drawn the first time it's rendered, and never in headless mode.
+    """
+
+    FILLED_COLOUR = (0, 255, 0)
+    EMPTY_COLOUR = (200, 200, 200)
+
+    def __init__(self, image, boxes, headless=False, show_all=False, highlight_colour=(0, 255, 0),
+                 digit_confidence=None, fields=None, marker_confidence=None, orientation=0):
+        self._image = image
+        self.boxes = boxes
+        self.digit_confidence = digit_confidence if digit_confidence is not None else {}
+        self.fields = fields if fields is not None else {}
+        self.marker_confidence = marker_confidence
+        self.orientation = orientation
+        self.headless = headless
+        self._show_all = show_all
+        self._highlight_colour = highlight_colour
+        self._marked = None
+        self.timing = None
+
+    @property
+    def image(self):
+        if callable(self._image):
+            self._image = self._image()
+        return self._image
+
+    @property
+    def confidence(self):
+        """
+        Sheet-level confidence, the margin of the least certain field or the confidence in the markers if that's lower.
+        """
+        margins = [field.margin for field in self.fields.values()]
+        if self.marker_confidence is not None:
+            margins.append(self.marker_confidence)
+        return min(margins or [1.0])
+
+    def ambiguous_fields(self, min_margin):
+        """
+        Ids of the fields decided with less than the given margin.
+        """
+        return [field_id for field_id, field in self.fields.items() if field.margin < min_margin]
+
+    def render(self):
+        if self.headless:
+            return self.image
+        if self._marked is None:
+            self._marked = self.image.copy()
+            for box in self.boxes:
+                x, y, width, height = box.rect
+                if box.kind == "image":
+                    if box.filled or self._show_all:
+                        cv2.rectangle(self._marked, (x, y), (x + width, y + height), self._highlight_colour,
+                                      thickness=3)
+                else:
+                    colour = self.FILLED_COLOUR if box.filled or self._show_all else self.EMPTY_COLOUR
+                    cv2.rectangle(self._marked, (x, y), (x + width, y + height), colour, thickness=3)
+        return self._marked
@@ -1,10 +1,31 @@
+import time
 from abc import abstractmethod
+from collections import OrderedDict
+from threading import Lock
 
 import numpy as np
 import cv2
 
+from scanners.annotation import BoxResult, FieldResult, MarkedSheet
+from scanners.image_writer import ImageWriter
+from scanners.reading import image_size, read_image
+from scanners.regions import WarpedSheet
+from scanners.segments import build_lookup_tables, pack_segments
+from scanners.template import get_template
+from scanners.timing import NULL_TIMING, SheetTiming
+
 
 class ScannerBase(object):
+    DEBUG_SHOW_ALL_BOXES = False
+    BOX_THRESHOLD = 150  # Mean thresholded grey level below which a box counts as filled.
+    IMAGE_BLANK_INK = 0.0005  # Image fields with less ink than this are blank without looking for contours.
+    IMAGE_DRAWN_INK = 0.01  # Image fields with more ink than this are drawn in without looking for contours.
+    IMAGE_CONTOUR_MARGIN = 0.5  # Margin given to Image fields that needed the contour test to decide.
+    DIGIT_MIN_CONFIDENCE = 0.5  # Digits that don't match exactly are resolved to the nearest digit above this.
+    BOX_FULL_FILL = 0.6  # Ink fill ratio of a clearly marked box, which gets a margin of 1.
+
+    SHEET_WIDTH = 8.5
+    SHEET_HEIGHT = 11
 
     POSITIONS = ['Red 1', 'Red 2', 'Red 3', 'Blue 1', 'Blue 2', 'Blue 3']
 
@@ -28,11 +49,299 @@ class ScannerBase(object):
                          None,
                          None,
                          [True, True, True, True, False, True, False]]
+    DIGIT_LUT, NEAREST_DIGIT_LUT, DIGIT_CONFIDENCE_LUT = build_lookup_tables(NUMBERS_MODEL, ALT_NUMBERS_MODEL)
+
+    def __init__(self, scan_fields, sheet_config, img_dir, headless=False):
+        self._scan_fields = scan_fields
+        self._config = sheet_config
+        self._img_dir = img_dir
+        self._marker_colour = sheet_config["marker_colour"]
+        self._highlight_colour = (0, 255, 0)  # RGB
+        self._template = None
+        self._image_writer = None
+        self._image_writer_lock = Lock()
+        self.headless = headless
+        self.stats = None
+
+    def set_config(self, config):
+        self._config = config
+        self._template = None
+
+    def set_fields(self, fields):
+        self._scan_fields = fields
+        self._template = None
+
+    def set_template(self, template):
+        self._scan_fields = template.fields
+        self._config = template.config
+        self._marker_colour = template.config["marker_colour"]
+        self._template = template
+
+    def get_template(self):
+        if self._template is None:
+            self._template = get_template(self._scan_fields, self._config, type(self))
+        return self._template
+
+    @classmethod
+    @abstractmethod
+    def field_boxes(cls, field, config):
+        """
+        Lists the (x, y, width, height) rects in inches of every box read for a field, in decoding order.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def image_box(cls, field, config):
+        """
+        The (x, y, width, height) rect in inches of an Image field.
+        """
+        pass
+
+    @classmethod
+    def marker_boxes(cls, config):
+        """
+        The (x, y, width, height) rects in inches of the markers printed on the sheet, one in each corner.
+        """
+        size = config["marker_size"]
+        return [(x, y, size, size) for y in (0, cls.SHEET_HEIGHT - size) for x in (0, cls.SHEET_WIDTH - size)]
 
     @abstractmethod
-    def scan_sheet(self, image):
+    def _crop_scan_area(self, img, timing=NULL_TIMING):
         pass
 
+    def _locate_sheet(self, img, timing=NULL_TIMING, orientation=None):
+        """
+        Finds the scan area of a scan, as a WarpedSheet or a RoiSheet to read boxes from. An orientation of 180 turns
+        the scan upside down first, by default it's read the way up it was scanned.
+        """
+        if orientation == 180:
+            img = cv2.rotate(img, cv2.ROTATE_180)
+        return WarpedSheet(self._crop_scan_area(img, timing), orientation=orientation or 0)
+
+    def get_image_writer(self):
+        """
+        The writer for Image field crops, made again if the image format settings changed. Prefetch threads and the
+        UI thread share it, so it's only made or replaced under a lock, and a replaced writer is closed once its
+        queued images are written.
+        """
+        image_format = self._config.get("image_format", "png")
+        compression = self._config.get("image_compression")
+        with self._image_writer_lock:
+            if self._image_writer is None or self._image_writer.settings != (image_format, compression):
+                if self._image_writer is not None:
+                    self._image_writer.close()
+                self._image_writer = ImageWriter(image_format, compression)
+            return self._image_writer
+
+    def flush_images(self):
+        """
+        Waits for every Image field crop queued so far to be written.
+        """
+        writer = self._image_writer
+        if writer is not None:
+            writer.flush()
+
+    def _read_boxes(self, sheet, template):
+        """
+        Reads every box of the template from the thresholded scan area, one field's boxes at a time for a RoiSheet.
+        """
+        rects = template.pixel_rects(*sheet.size)
+        values = sheet.sample(rects, [(plan.start, plan.stop) for plan in template.plans])
+        filled = values < self.BOX_THRESHOLD
+        fills, margins = self._box_fills(values)
+        rects, values, filled = rects.tolist(), values.tolist(), filled.tolist()
+        fills, margins = fills.tolist(), margins.tolist()
+        boxes = []
+        for plan in template.plans:
+            for i in range(plan.start, plan.stop):
+                boxes.append(BoxResult(plan.id, "box", tuple(rects[i]), values[i], filled[i], fills[i], margins[i]))
+        return boxes
+
+    def _box_fills(self, values):
+        """
+        Turns mean thresholded grey levels into ink fill ratios and margins of decision, from 0 to 1. A box's margin is
+        how far its fill is from the cut-off (about 0.41), as a fraction of the way to an empty box or to a clearly
+        marked one. Marks rarely cover a whole box, so a box counts as clearly marked once its fill reaches
+        box_full_fill (0.6 by default, about what a pen mark that leaves the corners of the box clear fills), and
+        fills above that are also given a margin of 1. A margin of 0.5 is a box halfway between the cut-off and empty
+        or clearly marked.
+        """
+        fills = np.clip(1 - values / 255.0, 0, 1)
+        cut_off = 1 - self.BOX_THRESHOLD / 255.0
+        full_fill = max(self._config.get("box_full_fill", self.BOX_FULL_FILL), cut_off + 0.01)
+        margins = np.where(fills > cut_off, np.minimum((fills - cut_off) / (full_fill - cut_off), 1),
+                           (cut_off - fills) / cut_off)
+        return fills, margins
+
+    def read_scan(self, filepath):
+        """
+        Reads a scan from disk. If decode_dpi is set, it's read at the smallest of 1/2, 1/4 or 1/8 size that still
+        has at least 90% of that resolution. JPEGs decode straight to that size.
+        """
+        decode_dpi = self._config.get("decode_dpi")
+        size = image_size(filepath) if decode_dpi else None
+        if size is None:
+            return read_image(filepath)
+        # Scans may be rotated either way, so compare the long side to the sheet's long side.
+        source_dpi = min(max(size) / max(self.SHEET_WIDTH, self.SHEET_HEIGHT),
+                         min(size) / min(self.SHEET_WIDTH, self.SHEET_HEIGHT))
+        return read_image(filepath, source_dpi / (0.9 * decode_dpi))
+
+    def set_stats(self, stats):
+        """
+        Records the stage timings of every sheet scanned from now on into a ScanStats, or stops if given None.
+        """
+        self.stats = stats
+
+    def scan_sheet(self, image, timing=None, orientation=None):
+        """
+        Decodes a scanned sheet, returning its data and a MarkedSheet. Stage times are added to the given SheetTiming,
+        or to a new one if stats are being kept. The sheet is read upside down if orientation is 180 and the right
+        way up if it's 0, or whichever way up the scanner makes it out to be if it's None.
+        """
+        if timing is None:
+            timing = SheetTiming() if self.stats is not None else NULL_TIMING
+        with timing.stage("scan"):
+            data, marked_sheet = self._decode_sheet(image, timing, orientation)
+        marked_sheet.timing = timing if timing is not NULL_TIMING else None
+        if self.stats is not None and timing is not NULL_TIMING:
+            self.stats.record(timing)
+        return data, marked_sheet
+
+    def _decode_sheet(self, image, timing, orientation=None):
+        template = self.get_template()
+        with timing.stage("crop"):
+            sheet = self._locate_sheet(image, timing, orientation)
+        img_width, img_height = sheet.size
+        data = OrderedDict({})
+
+        with timing.stage("threshold"):
+            sheet.threshold()
+        with timing.stage("boxes"):
+            boxes = self._read_boxes(sheet, template)
+        box_values = [box.filled for box in boxes]
+        image_boxes = []
+        digit_confidence = OrderedDict()
+        field_margins = OrderedDict()
+
+        for plan in template.plans:
+            field_start = time.perf_counter()
+            field = plan.field
+            label = plan.id
+            field_type = plan.type
+            values = box_values[plan.start:plan.stop]
+            field_margins[label] = min([box.margin for box in boxes[plan.start:plan.stop]] or [1.0])
+            if field_type == "Markers":
+                pass
+            elif field_type == "Digits":
+                codes = pack_segments(values)
+                confidence = self.DIGIT_CONFIDENCE_LUT[codes]
+                min_confidence = self._config.get("digit_min_confidence", self.DIGIT_MIN_CONFIDENCE)
+                digits = np.where(confidence >= min_confidence, self.NEAREST_DIGIT_LUT[codes], self.DIGIT_LUT[codes])
+                data[label] = "".join(str(d) if d >= 0 else "_" for d in digits.tolist())
+                digit_confidence[label] = confidence.tolist()
+                field_margins[label] = min(field_margins[label], float(confidence.min()))
+            elif field_type == "Barcode":
+                number = "".join(["1" if e else "0" for e in values][::-1])
+                try:
+                    data[label] = str(int(number, 2))
+                except:
+                    data[label] = ""
+
+            elif field_type == "BoxNumber":
+                number = ""
+                for i in range(field["options"]["digits"]):
+                    digit_values = values[i * 10:(i + 1) * 10]
+                    if True in digit_values:
+                        number += str(max([a * b for a, b in zip(digit_values, range(0, 10))]))
+                    else:
+                        number += "0"
+                data[label] = int(number)
+            elif field_type in ["HorizontalOptions", "Numbers", "Boolean"]:
+                options = field["options"]["options"]
+                data_type = field["options"]["type"]
+
+                if data_type == "Boolean":
+                    data[label] = 1 if values[0] else 0
+                elif data_type == "Numbers":
+                    total = 0
+                    for i in range(len(values)):
+                        if values[i]:
+                            if "+" in options[i]:
+                                total += int(options[i].strip("+"))
+                            else:
+                                total = int(options[i])
+                    data[label] = total
+                else:
+                    if True in values:
+                        val = list(reversed(options))[list(reversed(values)).index(True)]
+                        data[label] = val[0] if type(val) == list else val
+                    else:
+                        data[label] = ""
+
+            elif field_type == "BulkOptions":
+                headers = field["options"]["headers"]
+                options = field["options"]["options"]
+                bulk_data = {}
+                for i in range(len(headers)):
+                    bool_values = values[i * len(options):(i + 1) * len(options)]
+                    bulk_data[headers[i]] = [options[k] for k in range(len(options)) if bool_values[k]]
+                data[label] = bulk_data
+            elif field_type == "Image":
+                pt1, pt2 = template.pixel_image_rect(plan, img_width, img_height)
+
+                rect = (pt1[0], pt1[1], pt2[0] - pt1[0], pt2[1] - pt1[1])
+                value = sheet.sample([rect])[0]
+                ink = float(1 - value / 255.0)
+
+                if ink < self.IMAGE_BLANK_INK:
+                    save_img = False
+                    field_margins[label] = 1 - max(ink, 0) / self.IMAGE_BLANK_INK
+                elif ink > self.IMAGE_DRAWN_INK:
+                    save_img = True
+                    field_margins[label] = min(1.0, (ink - self.IMAGE_DRAWN_INK) / self.IMAGE_DRAWN_INK)
+                else:
+                    crop = sheet.region(rect)
+                    edged = cv2.Canny(crop, 100, 200)
+                    edged = cv2.blur(edged, (5, 5))
+                    contours = cv2.findContours(edged, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]  # OpenCV 3 and 4
+                    save_img = len(contours) > 4 or crop.mean() < 240
+                    field_margins[label] = self.IMAGE_CONTOUR_MARGIN
+
+                if save_img:
+                    with timing.stage("image_write"):
+                        writer = self.get_image_writer()
+                        filename = str(data["team_number"]) + "-" + str(data["encoded_match_data"]) + "_" + label
+                        writer.write(self._img_dir + filename + writer.extension, sheet.region(rect).copy())
+
+                image_boxes.append(BoxResult(label, "image", rect, value, save_img, min(max(ink, 0), 1),
+                                             field_margins[label]))
+                data[label] = str(save_img)
+            timing.add("field:" + field_type, time.perf_counter() - field_start)
+
+        data["match"] = int("0" + data["encoded_match_data"][0:-1])
+        data["pos"] = int("0" + data["encoded_match_data"][-1])
+        data.move_to_end("pos", last=False)
+        data.move_to_end("match", last=False)
+
+        del data["encoded_match_data"]
+
+        field_results = OrderedDict()
+        match_margin = field_margins["encoded_match_data"]
+        field_results["match"] = FieldResult("match", "Barcode", data["match"], match_margin)
+        field_results["pos"] = FieldResult("pos", "Barcode", data["pos"], match_margin)
+        for plan in template.plans:
+            if plan.id in data:
+                field_results[plan.id] = FieldResult(plan.id, plan.type, data[plan.id], field_margins[plan.id])
+
+        sheet.release()
+        marked_sheet = MarkedSheet(sheet.full_image, boxes + image_boxes, headless=self.headless,
+                                   show_all=self.DEBUG_SHOW_ALL_BOXES, highlight_colour=self._highlight_colour,
+                                   digit_confidence=digit_confidence, fields=field_results,
+                                   marker_confidence=sheet.marker_confidence, orientation=sheet.orientation)
+        return data, marked_sheet
+
     @staticmethod
     def _get_colour_mask_range(*rgb, sensitivity=10):
         target_colour = np.uint8([[rgb]])
@@ -43,8 +352,10 @@ class ScannerBase(object):
 
     @staticmethod
     def _round_colours(img):
-        img = ((img / 255.0).round() * 255)
-        return img.astype(np.uint8)
+        """
+        Snaps every channel to 0 or 255, same as rounding channel / 255.
+        """
+        return cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)[1]
 
     @staticmethod
     def _show_sheet(img, title="Image"):
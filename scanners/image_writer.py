@@ -0,0 +1,79 @@
+import atexit
+import weakref
+from queue import Queue
+from threading import Lock, Thread
+
+import cv2
+
+_running = weakref.WeakSet()  # Writers with a thread, flushed when the process exits.
+
+
+@atexit.register
+def _flush_running():
+    for writer in list(_running):
+        writer.flush()
+
+
+class ImageWriter(object):
+    """
+    Encodes and writes images on a background thread so the caller doesn't wait on the encoder.
+    """
+
+    FORMATS = {
+        'png':  ('.png', cv2.IMWRITE_PNG_COMPRESSION, 3),
+        'jpg':  ('.jpg', cv2.IMWRITE_JPEG_QUALITY, 90),
+        'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY, 90)
+    }
+
+    def __init__(self, image_format='png', compression=None):
+        self.settings = (image_format, compression)
+        self.extension, param, default = self.FORMATS[image_format]
+        self._params = [param, default if compression is None else int(compression)]
+        self._queue = Queue()
+        self._thread = None
+        self._lock = Lock()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:  # Closed.
+                self._queue.task_done()
+                return
+            filepath, img = job
+            try:
+                if not cv2.imwrite(filepath, img, self._params):
+                    print("Failed to write " + filepath)
+            except Exception as ex:
+                print(ex)
+            finally:
+                self._queue.task_done()
+
+    def write(self, filepath, img):
+        """
+        Queues an image to be written. The image must not be modified afterwards.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._work, name='ImageWriter')
+                self._thread.daemon = True
+                self._thread.start()
+                _running.add(self)
+            self._queue.put((filepath, img))
+
+    def flush(self):
+        """
+        Blocks until every queued image has been written.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Writes every queued image and stops the thread. Writing again starts a new one.
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            _running.discard(self)
@@ -1,212 +1,82 @@
-from collections import OrderedDict
-
 import cv2
 import numpy as np
 
 from scanners.base import ScannerBase
+from scanners.timing import NULL_TIMING
 
 
 class LegacyScanner(ScannerBase):
-    DEBUG_SHOW_ALL_BOXES = False
-
-    SHEET_WIDTH = 8.5
-    SHEET_HEIGHT = 11
-
-    def __init__(self, scan_fields, sheet_config, img_dir):
-        super().__init__()
-        self._scan_fields = scan_fields
-        self._config = sheet_config
-        self._img_dir = img_dir
-        self._marker_colour = sheet_config["marker_colour"]
-        self._highlight_colour = (0, 255, 0)  # RGB
-        self._xy_factors = (1, 1)
-
-    def set_config(self, config):
-        self._config = config
-
-    def set_fields(self, fields):
-        self._scan_fields = fields
-
-    def _read_box(self, src, dst, x, y, width, height, min_val=50):
-        x = int(x * self._xy_factors[0])
-        y = int(y * self._xy_factors[1])
-        width = int(width * self._xy_factors[0])
-        height = int(height * self._xy_factors[1])
-        img2 = src[y:y + height, x:x + width]
-
-        avg = img2.sum() / (3 * img2.size)
 
-        if avg < min_val or self.DEBUG_SHOW_ALL_BOXES:
-            cv2.rectangle(dst, (x, y), (x + width, y + height), (0, 255, 0), thickness=3)
+    @classmethod
+    def field_boxes(cls, field, config):
+        box_size = config["box_size"]
+        box_spacing = config["box_spacing"]
+        y_spacing = config["y_spacing"]
+        field_type = field["type"]
+        x_pos = field["x_pos"]
+        y_pos = field["y_pos"]
+        boxes = []
+        if field_type == "Digits":
+            width = config["seven_segment_width"]
+            thickness = config["seven_segment_thickness"]
+            spacing = config["seven_segment_offset"]
+            for i in range(4):
+                boxes += [
+                    (x_pos + thickness + spacing * i, y_pos, width, thickness),
+                    (x_pos + spacing * i, y_pos + thickness, thickness, width),
+                    (x_pos + spacing * i + thickness + width, y_pos + thickness, thickness, width),
+                    (x_pos + thickness + spacing * i, y_pos + width + thickness, width, thickness),
+                    (x_pos + spacing * i, y_pos + width + thickness + thickness, thickness, width),
+                    (x_pos + spacing * i + thickness + width, y_pos + width + thickness + thickness, thickness, width),
+                    (x_pos + thickness + spacing * i, y_pos + (width + thickness) * 2, width, thickness)]
+        elif field_type == "Barcode":
+            digits = len(bin(int("9" * field["options"]["digits"]))[2:]) - 3
+            x_offset = -box_size
+            for i in range(digits):
+                boxes.append((x_pos + x_offset, y_pos, box_size, box_size))
+                x_offset -= box_size + config['barcode_spacing']
+        elif field_type == "BoxNumber":
+            x_pos += config["label_offset"]
+            y_pos += y_spacing * 2
+            for i in range(field["options"]["digits"]):
+                for j in range(10):
+                    boxes.append((x_pos + j * (box_size + box_spacing), y_pos + (y_spacing * 1.5 * i),
+                                  box_size, box_size))
+        elif field_type in ["HorizontalOptions", "Numbers", "Boolean"]:
+            note_width = 0 if not field["options"]["note_space"] else (1 + field["options"]["note_width"]) * (
+                box_size + box_spacing)
+            x_pos += config["label_offset"] + note_width + config["marker_size"]
+            for i in range(len(field["options"]["options"])):
+                boxes.append((x_pos + i * (box_size + box_spacing), y_pos, box_size, box_size))
+        elif field_type == "BulkOptions":
+            for i in range(len(field["options"]["headers"])):
+                for j in range(len(field["options"]["options"])):
+                    boxes.append((x_pos + i * (box_size + box_spacing), y_pos + j * (box_size + box_spacing),
+                                  box_size, box_size))
+        return boxes
+
+    @classmethod
+    def image_box(cls, field, config):
+        x_pos = field["x_pos"] + config["marker_size"]
+        y_pos = field["y_pos"]
+        if field["options"]["prev_line"]:
+            x_pos += field["options"]["offset"] + 1
+            y_pos -= field["options"]["y_offset"] + 0.2375
         else:
-            cv2.rectangle(dst, (x, y), (x + width, y + height), (200, 200, 200), thickness=3)
-
-        return avg < min_val
-
-    def scan_sheet(self, image):
-        scan_area = self._crop_scan_area(image)
-        img_height, img_width, img_channels = scan_area.shape
-        self._xy_factors = (img_width / self.SHEET_WIDTH, img_height / self.SHEET_HEIGHT)
-        box_size = self._config["box_size"]
-        box_spacing = self._config["box_spacing"]
-        y_spacing = self._config["y_spacing"]
-        data = OrderedDict({})
-
-        img2 = cv2.cvtColor(scan_area, cv2.COLOR_RGB2GRAY)
-        thresh, img2 = cv2.threshold(img2, 100, 255, cv2.THRESH_BINARY)
-
-        for field in list(self._scan_fields):
-            label = field["id"]
-            field_type = field["type"]
-            x_pos = field["x_pos"]
-            y_pos = field["y_pos"]
-            if field_type == "Markers":
-                pass
-            elif field_type == "Digits":
-                width = self._config["seven_segment_width"]
-                thickness = self._config["seven_segment_thickness"]
-                spacing = self._config["seven_segment_offset"]
-                nums = ""
-                for i in range(4):
-                    parts = [
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos, width, thickness),
-                        self._read_box(img2, scan_area, x_pos + spacing * i, y_pos + thickness, thickness, width),
-                        self._read_box(img2, scan_area, x_pos + spacing * i + thickness + width, y_pos + thickness, thickness,
-                                       width),
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos + width + thickness, width,
-                                       thickness),
-                        self._read_box(img2, scan_area, x_pos + spacing * i, y_pos + width + thickness + thickness, thickness,
-                                       width),
-                        self._read_box(img2, scan_area, x_pos + spacing * i + thickness + width,
-                                       y_pos + width + thickness + thickness, thickness, width),
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos + (width + thickness) * 2,
-                                       width, thickness)]
-                    for j in range(10):
-                        if self.NUMBERS_MODEL[j] == parts:
-                            nums += str(j)
-                            break
-                        elif self.ALT_NUMBERS_MODEL[j] == parts:
-                            nums += str(j)
-                            break
-                    else:
-                        nums += "_"
-                data[label] = nums
-            elif field_type == "Barcode":
-                digits = len(bin(int("9" * field["options"]["digits"]))[2:]) - 3
-                x_offset = -box_size
-                values = []
-                for i in range(digits):
-                    values.append(self._read_box(img2, scan_area, x_pos + x_offset, y_pos, box_size, box_size))
-                    x_offset -= box_size + self._config['barcode_spacing']
-                number = "".join(["1" if e else "0" for e in values][::-1])
-                try:
-                    data[label] = str(int(number, 2))
-                except:
-                    data[label] = ""
-
-            elif field_type == "BoxNumber":
-                digits = field["options"]["digits"]
-                x_pos += self._config["label_offset"]
-                y_pos += y_spacing * 2
-                number = ""
-                for i in range(digits):
-                    values = []
-                    for j in range(10):
-                        box_val = self._read_box(img2, scan_area, x_pos + j * (box_size + box_spacing),
-                                                 y_pos + (y_spacing * 1.5 * i), box_size, box_size)
-                        values.append(box_val)
-                    if True in values:
-                        number += str(max([a * b for a, b in zip(values, range(0, 10))]))
-                    else:
-                        number += "0"
-                data[label] = int(number)
-            elif field_type in ["HorizontalOptions", "Numbers", "Boolean"]:
-                options = field["options"]["options"]
-                note_width = 0 if not field["options"]["note_space"] else (1 + field["options"]["note_width"]) * (
-                    box_size + box_spacing)
-                x_pos += self._config["label_offset"] + note_width + self._config["marker_size"]
-                data_type = field["options"]["type"]
-
-                values = []
-                for i in range(len(options)):
-                    box_val = self._read_box(img2, scan_area, x_pos + i * (box_size + box_spacing), y_pos, box_size, box_size)
-                    values.append(box_val)
+            x_pos += 1
+        return x_pos, y_pos, field["options"]["width"], field["options"]["height"]
 
-                if data_type == "Boolean":
-                    data[label] = 1 if values[0] else 0
-                elif data_type == "Numbers":
-                    total = 0
-                    for i in range(len(values)):
-                        if values[i]:
-                            if "+" in options[i]:
-                                total += int(options[i].strip("+"))
-                            else:
-                                total = int(options[i])
-                    data[label] = total
-                else:
-                    if True in values:
-                        val = list(reversed(options))[list(reversed(values)).index(True)]
-                        data[label] = val[0] if type(val) == list else val
-                    else:
-                        data[label] = ""
+    @classmethod
+    def marker_boxes(cls, config):
+        """
+        Legacy sheets only have markers in the top left and bottom right corners, which the scan area spans.
+        """
+        size = config["marker_size"]
+        return [(0, 0, size, size), (cls.SHEET_WIDTH - size, cls.SHEET_HEIGHT - size, size, size)]
 
-            elif field_type == "BulkOptions":
-                headers = field["options"]["headers"]
-                options = field["options"]["options"]
-                bulk_data = {}
-                for i in range(len(headers)):
-                    header = headers[i]
-                    bool_values = []
-                    values = []
-                    for j in range(len(options)):
-                        value = self._read_box(img2, scan_area, x_pos + i * (box_size + box_spacing),
-                                               y_pos + j * (box_size + box_spacing), box_size, box_size)
-                        bool_values.append(value)
-                    for k in range(len(bool_values)):
-                        if bool_values[k]:
-                            values.append(options[k])
-                    bulk_data[header] = values
-                data[label] = bulk_data
-            elif field_type == "Image":
-                width = field["options"]["width"]
-                height = field["options"]["height"]
-                x_pos += self._config["marker_size"]
-                if field["options"]["prev_line"]:
-                    x_pos += field["options"]["offset"] + 1
-                    y_pos -= field["options"]["y_offset"] + 0.2375
-                else:
-                    x_pos += 1
-
-                pt1 = (int(x_pos * self._xy_factors[0]), int(y_pos * self._xy_factors[1]))
-                pt2 = (int((x_pos + width) * self._xy_factors[0]), int((y_pos + height) * self._xy_factors[1]))
-
-                crop = scan_area[pt1[1]:pt2[1], pt1[0]:pt2[0]]
-
-                edged = cv2.Canny(crop, 100, 200)
-                edged = cv2.blur(edged, (5, 5))
-                (_, contours, _) = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-                save_img = len(contours) > 4 or crop.mean() < 240
-                if save_img:
-                    filename = str(data["team_number"]) + "-" + str(data["encoded_match_data"]) + "_" + label + ".png"
-                    cv2.imwrite(self._img_dir + filename, crop)
-
-                if save_img or self.DEBUG_SHOW_ALL_BOXES:
-                    cv2.rectangle(scan_area, pt1, pt2, self._highlight_colour, thickness=3)
-                data[label] = str(save_img)
-
-        data["match"] = int("0" + data["encoded_match_data"][0:-1])
-        data["pos"] = int("0" + data["encoded_match_data"][-1])
-        data.move_to_end("pos", last=False)
-        data.move_to_end("match", last=False)
-
-        del data["encoded_match_data"]
-
-        return data, scan_area
-
-    def _crop_scan_area(self, img):
-        img2 = img[:]
-        img2 = self._round_colours(img2)
+    def _crop_scan_area(self, img, timing=NULL_TIMING):
+        with timing.stage("round_colours"):
+            img2 = self._round_colours(img)
 
         hue_target = list(cv2.cvtColor(np.array([[self._marker_colour]]).astype(np.uint8), cv2.COLOR_RGB2HSV)[0, 0])
         if hue_target[0] < 10 or hue_target[0] > 170:
@@ -223,20 +93,18 @@ class LegacyScanner(ScannerBase):
         edged = cv2.Canny(res, 100, 200)
         edged = cv2.blur(edged, (5, 5))
 
-        (_, contours, _) = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        contours = cv2.findContours(edged, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[-2]  # OpenCV 3 and 4
         contours = sorted(contours, key=cv2.contourArea, reverse=True)[:2]
-        cv2.drawContours(res, contours, -1, (0, 255, 0), 3)
 
-        x_coords = []
-        y_coords = []
-
-        for cnt in contours[:4]:
-            for e in cnt:
-                for d in e:
-                    x_coords.append(d[0])
-                    y_coords.append(d[1])
-
-        upper_left_corner = (min(x_coords), min(y_coords))
-        lower_right_corner = (int(max(x_coords)), max(y_coords))
+        points = np.concatenate([cnt.reshape(-1, 2) for cnt in contours])
+        upper_left_corner = points.min(axis=0)
+        lower_right_corner = points.max(axis=0)
         cropped_img = img[upper_left_corner[1]:lower_right_corner[1], upper_left_corner[0]:lower_right_corner[0]]
+
+        decode_dpi = self._config.get("decode_dpi")
+        if decode_dpi:
+            with timing.stage("resize"):
+                cropped_img = cv2.resize(cropped_img, (int(self.SHEET_WIDTH * decode_dpi),
+                                                       int(self.SHEET_HEIGHT * decode_dpi)),
+                                         interpolation=cv2.INTER_AREA)
         return cropped_img
@@ -0,0 +1,53 @@
+import struct
+
+import cv2
+
+REDUCED_READ_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def image_size(filepath):
+    """
+    The (width, height) of a PNG or JPEG read from its header without decoding it, or None if it can't be told.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            head = f.read(24)
+            if head.startswith(_PNG_SIGNATURE) and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if not head.startswith(b'\xff\xd8'):
+                return None
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                while marker[1] == 0xFF:  # Padding before a marker.
+                    next_byte = f.read(1)
+                    if not next_byte:  # Truncated in the padding.
+                        return None
+                    marker = marker[1:] + next_byte
+                code = marker[1]
+                if code in _JPEG_SOF_MARKERS:
+                    height, width = struct.unpack('>3xHH', f.read(7))
+                    return width, height
+                if code in (0xD9, 0xDA):  # End of image or start of scan before a frame header.
+                    return None
+                if 0xD0 <= code <= 0xD7 or code == 0x01:  # Markers without a length.
+                    continue
+                length, = struct.unpack('>H', f.read(2))
+                f.seek(length - 2, 1)
+    except (IOError, OSError, struct.error):
+        return None
+
+
+def read_image(filepath, max_reduction=1):
+    """
+    Reads an image at 1/2, 1/4 or 1/8 of its size if max_reduction allows it, which JPEGs decode straight to.
+    """
+    for reduction, flag in REDUCED_READ_FLAGS:
+        if reduction <= max_reduction:
+            return cv2.imread(filepath, flag)
+    return cv2.imread(filepath)
@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+from scanners.sampling import integral_image, sample_boxes
+
+
+def threshold_image(img):
+    """
+    Greys and binarizes a colour image the way every box is read.
+    """
+    img = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return cv2.threshold(img, 100, 255, cv2.THRESH_BINARY)[1]
+
+
+class WarpedSheet(object):
+    """
+    A scan area that was warped whole. Boxes are sampled from one integral image of all of it. orientation is 180 if
+    the scan was turned upside down to warp it.
+    """
+
+    def __init__(self, image, marker_confidence=None, orientation=0):
+        self.image = image
+        self.size = (image.shape[1], image.shape[0])
+        self.marker_confidence = marker_confidence
+        self.orientation = orientation
+        self._integral = None
+
+    def threshold(self):
+        if self._integral is None:
+            self._integral = integral_image(threshold_image(self.image))
+        return self._integral
+
+    def sample(self, rects, groups=None):
+        """
+        Mean thresholded grey level of every (x, y, width, height) pixel rect.
+        """
+        return sample_boxes(self.threshold(), rects)
+
+    def region(self, rect):
+        x, y, width, height = rect
+        return self.image[y:y + height, x:x + width]
+
+    def full_image(self):
+        return self.image
+
+    def release(self):
+        self._integral = None
+
+
+class RoiSheet(object):
+    """
+    A scan area that's only warped where it's read. Each group of boxes is sampled from a warp of just the rect around
+    them, Image fields are warped when they're looked at and the whole scan area only if something asks for it, like
+    drawing the marked sheet. Every pixel is mapped through the same homography as a whole warp, so the values read
+    are the same.
+    """
+
+    def __init__(self, source, warp_matrix, size, marker_confidence=None, orientation=0):
+        self.source = source
+        self.warp_matrix = warp_matrix
+        self.size = tuple(size)
+        self.marker_confidence = marker_confidence
+        self.orientation = orientation
+        self._regions = {}
+        self._image = None
+
+    def _warp(self, x, y, width, height):
+        shift = np.array([[1, 0, -x], [0, 1, -y], [0, 0, 1]], dtype=np.float64)
+        return cv2.warpPerspective(self.source, shift.dot(self.warp_matrix), (width, height),
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+
+    def threshold(self):
+        """
+        Regions are thresholded as they're sampled, so there's nothing to do up front.
+        """
+        pass
+
+    def sample(self, rects, groups=None):
+        """
+        Mean thresholded grey level of every (x, y, width, height) pixel rect. Each (start, stop) group of rects is
+        read from one warped region, all of them together if no groups are given.
+        """
+        rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        values = np.full(len(rects), np.inf)
+        for start, stop in groups if groups is not None else [(0, len(rects))]:
+            group = rects[start:stop]
+            if not len(group):
+                continue
+            x0, y0 = np.maximum(group[:, :2].min(axis=0), 0)
+            x1, y1 = np.minimum((group[:, :2] + group[:, 2:]).max(axis=0), self.size)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            integral = integral_image(threshold_image(self.region((x0, y0, x1 - x0, y1 - y0))))
+            values[start:stop] = sample_boxes(integral, group - (x0, y0, 0, 0))
+        return values
+
+    def region(self, rect):
+        """
+        The warped pixels of a rect, clipped to the scan area.
+        """
+        x, y, width, height = [int(v) for v in rect]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.size[0]), min(y + height, self.size[1])
+        if x1 <= x0 or y1 <= y0:
+            return self.source[0:0, 0:0]
+        key = (x0, y0, x1 - x0, y1 - y0)
+        if key not in self._regions:
+            if self._image is not None:
+                self._regions[key] = self._image[y0:y1, x0:x1]
+            else:
+                self._regions[key] = self._warp(*key)
+        return self._regions[key]
+
+    def full_image(self):
+        if self._image is None:
+            self._image = self._warp(0, 0, *self.size)
+        return self._image
+
+    def release(self):
+        self._regions = {}
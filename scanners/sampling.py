@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+
+
+def integral_image(img):
+    """
+    Summed-area table of a single channel image, one row and column larger than the image.
+    """
+    return cv2.integral(img, sdepth=cv2.CV_64F)
+
+
+def sample_boxes(integral, rects):
+    """
+    Mean pixel value of every (x, y, width, height) rectangle in an (N, 4) array of pixel rects.
+    Rects are clipped to the image, rects with no area left get a mean of infinity.
+    """
+    rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+    img_height = integral.shape[0] - 1
+    img_width = integral.shape[1] - 1
+
+    x0 = np.clip(rects[:, 0], 0, img_width)
+    y0 = np.clip(rects[:, 1], 0, img_height)
+    x1 = np.clip(rects[:, 0] + rects[:, 2], 0, img_width)
+    y1 = np.clip(rects[:, 1] + rects[:, 3], 0, img_height)
+
+    sums = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    areas = ((x1 - x0) * (y1 - y0)).astype(np.float64)
+
+    means = np.full(len(rects), np.inf)
+    np.divide(sums, areas, out=means, where=areas > 0)
+    return means
@@ -1,213 +1,178 @@
-from collections import OrderedDict
-
 import cv2
 import numpy as np
 
 from scanners.base import ScannerBase
+from scanners.regions import RoiSheet, WarpedSheet, threshold_image
+from scanners.sampling import integral_image, sample_boxes
+from scanners.timing import NULL_TIMING
 
 
 class Scanner(ScannerBase):
-    DEBUG_SHOW_ALL_BOXES = False
-
-    SHEET_WIDTH = 8.5
-    SHEET_HEIGHT = 11
-
-    def __init__(self, scan_fields, sheet_config, img_dir):
-        super().__init__()
-        self._scan_fields = scan_fields
-        self._config = sheet_config
-        self._img_dir = img_dir
-        self._marker_colour = sheet_config["marker_colour"]
-        self._highlight_colour = (0, 255, 0)  # RGB
-        self._xy_factors = (1, 1)
-
-    def set_config(self, config):
-        self._config = config
-
-    def set_fields(self, fields):
-        self._scan_fields = fields
-
-    def _read_box(self, src, dst, x, y, width, height, min_val=50):
-        x = int(x * self._xy_factors[0])
-        y = int(y * self._xy_factors[1])
-        width = int(width * self._xy_factors[0])
-        height = int(height * self._xy_factors[1])
-        img2 = src[y:y + height, x:x + width]
-
-        avg = img2.sum() / (3 * img2.size)
-
-        if avg < min_val or self.DEBUG_SHOW_ALL_BOXES:
-            cv2.rectangle(dst, (x, y), (x + width, y + height), (0, 255, 0), thickness=3)
+    MARKER_AREA_RANGE = (0.1, 4.0)  # Blobs outside this fraction of the expected marker area aren't markers.
+    MARKER_MIN_QUALITY = 0.3  # Blobs less square or solid than this aren't markers.
+    ORIENTATION_DPI = 50  # Resolution a sheet is warped to to tell which way up it is.
+    ORIENTATION_MIN_RATIO = 2.0  # How many times more ink the boxes must hold upside down for a sheet to be turned.
+
+    @classmethod
+    def field_boxes(cls, field, config):
+        box_size = config["box_size"]
+        box_spacing = config["box_spacing"]
+        y_spacing = config["y_spacing"]
+        field_type = field["type"]
+        x_pos = field["x_pos"]
+        y_pos = field["y_pos"]
+        boxes = []
+        if field_type == "Digits":
+            width = config["seven_segment_width"]
+            thickness = config["seven_segment_thickness"]
+            spacing = config["seven_segment_offset"]
+            for i in range(4):
+                boxes += [
+                    (x_pos + thickness + spacing * i, y_pos, width, thickness),
+                    (x_pos + spacing * i, y_pos + thickness, thickness, width),
+                    (x_pos + spacing * i + thickness + width, y_pos + thickness, thickness, width),
+                    (x_pos + thickness + spacing * i, y_pos + width + thickness, width, thickness),
+                    (x_pos + spacing * i, y_pos + width + thickness + thickness, thickness, width),
+                    (x_pos + spacing * i + thickness + width, y_pos + width + thickness + thickness, thickness, width),
+                    (x_pos + thickness + spacing * i, y_pos + (width + thickness) * 2, width, thickness)]
+        elif field_type == "Barcode":
+            digits = len(bin(int("9" * field["options"]["digits"]))[2:]) - 3
+            x_offset = -box_size
+            for i in range(digits):
+                boxes.append((x_pos + x_offset, y_pos, box_size, box_size))
+                x_offset -= box_size + config['barcode_spacing']
+        elif field_type == "BoxNumber":
+            x_pos += config["label_offset"]
+            y_pos += y_spacing * 1.5
+            for i in range(field["options"]["digits"]):
+                for j in range(10):
+                    boxes.append((x_pos + j * (box_size + box_spacing), y_pos + (y_spacing * 1.5 * i),
+                                  box_size, box_size))
+        elif field_type in ["HorizontalOptions", "Numbers", "Boolean"]:
+            note_width = 0 if not field["options"]["note_space"] else (1 + field["options"]["note_width"]) * (
+                box_size + box_spacing)
+            x_pos += config["label_offset"] + note_width + config["marker_size"] + field['options']['offset']
+            for i in range(len(field["options"]["options"])):
+                boxes.append((x_pos + i * (box_size + box_spacing), y_pos, box_size, box_size))
+        elif field_type == "BulkOptions":
+            for i in range(len(field["options"]["headers"])):
+                for j in range(len(field["options"]["options"])):
+                    boxes.append((x_pos + i * (box_size + box_spacing), y_pos + j * (box_size + box_spacing),
+                                  box_size, box_size))
+        return boxes
+
+    @classmethod
+    def image_box(cls, field, config):
+        x_pos = field["x_pos"] + config["marker_size"]
+        y_pos = field["y_pos"]
+        if field["options"]["prev_line"]:
+            x_pos += field["options"]["offset"] + 1
+            y_pos -= field["options"]["y_offset"] + 0.2375
         else:
-            cv2.rectangle(dst, (x, y), (x + width, y + height), (200, 200, 200), thickness=3)
-
-        return avg < min_val
-
-    def scan_sheet(self, image):
-        scan_area = self._crop_scan_area(image)
-        img_height, img_width, img_channels = scan_area.shape
-        self._xy_factors = (img_width / self.SHEET_WIDTH, img_height / self.SHEET_HEIGHT)
-        box_size = self._config["box_size"]
-        box_spacing = self._config["box_spacing"]
-        y_spacing = self._config["y_spacing"]
-        data = OrderedDict({})
-
-        img2 = cv2.cvtColor(scan_area, cv2.COLOR_RGB2GRAY)
-        thresh, img2 = cv2.threshold(img2, 100, 255, cv2.THRESH_BINARY)
-
-        for field in list(self._scan_fields):
-            label = field["id"]
-            field_type = field["type"]
-            x_pos = field["x_pos"]
-            y_pos = field["y_pos"]
-            if field_type == "Markers":
-                pass
-            elif field_type == "Digits":
-                width = self._config["seven_segment_width"]
-                thickness = self._config["seven_segment_thickness"]
-                spacing = self._config["seven_segment_offset"]
-                nums = ""
-                for i in range(4):
-                    parts = [
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos, width, thickness),
-                        self._read_box(img2, scan_area, x_pos + spacing * i, y_pos + thickness, thickness, width),
-                        self._read_box(img2, scan_area, x_pos + spacing * i + thickness + width, y_pos + thickness, thickness,
-                                       width),
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos + width + thickness, width,
-                                       thickness),
-                        self._read_box(img2, scan_area, x_pos + spacing * i, y_pos + width + thickness + thickness, thickness,
-                                       width),
-                        self._read_box(img2, scan_area, x_pos + spacing * i + thickness + width,
-                                       y_pos + width + thickness + thickness, thickness, width),
-                        self._read_box(img2, scan_area, x_pos + thickness + spacing * i, y_pos + (width + thickness) * 2,
-                                       width, thickness)]
-                    for j in range(10):
-                        if self.NUMBERS_MODEL[j] == parts:
-                            nums += str(j)
-                            break
-                        elif self.ALT_NUMBERS_MODEL[j] == parts:
-                            nums += str(j)
-                            break
-                    else:
-                        nums += "_"
-                data[label] = nums
-            elif field_type == "Barcode":
-                digits = len(bin(int("9" * field["options"]["digits"]))[2:]) - 3
-                x_offset = -box_size
-                values = []
-                for i in range(digits):
-                    values.append(self._read_box(img2, scan_area, x_pos + x_offset, y_pos, box_size, box_size))
-                    x_offset -= box_size + self._config['barcode_spacing']
-                number = "".join(["1" if e else "0" for e in values][::-1])
-                try:
-                    data[label] = str(int(number, 2))
-                except:
-                    data[label] = ""
-
-            elif field_type == "BoxNumber":
-                digits = field["options"]["digits"]
-                x_pos += self._config["label_offset"]
-                y_pos += y_spacing * 1.5
-                number = ""
-                for i in range(digits):
-                    values = []
-                    for j in range(10):
-                        box_val = self._read_box(img2, scan_area, x_pos + j * (box_size + box_spacing),
-                                                 y_pos + (y_spacing * 1.5 * i), box_size, box_size)
-                        values.append(box_val)
-                    if True in values:
-                        number += str(max([a * b for a, b in zip(values, range(0, 10))]))
-                    else:
-                        number += "0"
-                data[label] = int(number)
-            elif field_type in ["HorizontalOptions", "Numbers", "Boolean"]:
-                options = field["options"]["options"]
-                note_width = 0 if not field["options"]["note_space"] else (1 + field["options"]["note_width"]) * (
-                    box_size + box_spacing)
-                x_pos += self._config["label_offset"] + note_width + self._config["marker_size"] + field['options']['offset']
-                data_type = field["options"]["type"]
-
-                values = []
-                for i in range(len(options)):
-                    box_val = self._read_box(img2, scan_area, x_pos + i * (box_size + box_spacing), y_pos, box_size, box_size)
-                    values.append(box_val)
-
-                if data_type == "Boolean":
-                    data[label] = 1 if values[0] else 0
-                elif data_type == "Numbers":
-                    total = 0
-                    for i in range(len(values)):
-                        if values[i]:
-                            if "+" in options[i]:
-                                total += int(options[i].strip("+"))
-                            else:
-                                total = int(options[i])
-                    data[label] = total
-                else:
-                    if True in values:
-                        val = list(reversed(options))[list(reversed(values)).index(True)]
-                        data[label] = val[0] if type(val) == list else val
-                    else:
-                        data[label] = ""
-
-            elif field_type == "BulkOptions":
-                headers = field["options"]["headers"]
-                options = field["options"]["options"]
-                bulk_data = {}
-                for i in range(len(headers)):
-                    header = headers[i]
-                    bool_values = []
-                    values = []
-                    for j in range(len(options)):
-                        value = self._read_box(img2, scan_area, x_pos + i * (box_size + box_spacing),
-                                               y_pos + j * (box_size + box_spacing), box_size, box_size)
-                        bool_values.append(value)
-                    for k in range(len(bool_values)):
-                        if bool_values[k]:
-                            values.append(options[k])
-                    bulk_data[header] = values
-                data[label] = bulk_data
-            elif field_type == "Image":
-                width = field["options"]["width"]
-                height = field["options"]["height"]
-                x_pos += self._config["marker_size"]
-                if field["options"]["prev_line"]:
-                    x_pos += field["options"]["offset"] + 1
-                    y_pos -= field["options"]["y_offset"] + 0.2375
-                else:
-                    x_pos += 1
-
-                pt1 = (int(x_pos * self._xy_factors[0]), int(y_pos * self._xy_factors[1]))
-                pt2 = (int((x_pos + width) * self._xy_factors[0]), int((y_pos + height) * self._xy_factors[1]))
-
-                crop = scan_area[pt1[1]:pt2[1], pt1[0]:pt2[0]]
-
-                edged = cv2.Canny(crop, 100, 200)
-                edged = cv2.blur(edged, (5, 5))
-                (_, contours, _) = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-                save_img = len(contours) > 4 or crop.mean() < 240
-                if save_img:
-                    filename = str(data["team_number"]) + "-" + str(data["encoded_match_data"]) + "_" + label + ".png"
-                    cv2.imwrite(self._img_dir + filename, crop)
-
-                if save_img or self.DEBUG_SHOW_ALL_BOXES:
-                    cv2.rectangle(scan_area, pt1, pt2, self._highlight_colour, thickness=3)
-                data[label] = str(save_img)
+            x_pos += 1
+        return x_pos, y_pos, field["options"]["width"], field["options"]["height"]
 
-        data["match"] = int("0" + data["encoded_match_data"][0:-1])
-        data["pos"] = int("0" + data["encoded_match_data"][-1])
-        data.move_to_end("pos", last=False)
-        data.move_to_end("match", last=False)
-
-        del data["encoded_match_data"]
-
-        return data, scan_area
+    def _crop_scan_area(self, img, timing=NULL_TIMING):
+        located = self._sheet_homography(img, timing)
+        if located is None:
+            return img
+        return self._warp_scan_area(img, located[0], located[1], timing)
+
+    def _warp_scan_area(self, img, warp_matrix, size, timing=NULL_TIMING):
+        with timing.stage("warp"):
+            return cv2.warpPerspective(img, warp_matrix, size, borderMode=cv2.BORDER_CONSTANT,
+                                       borderValue=(255, 255, 255))
+
+    def _locate_sheet(self, img, timing=NULL_TIMING, orientation=None):
+        """
+        Warps the scan area, or with roi_warp set returns a RoiSheet that only warps the parts of it that are read.
+        """
+        located = self._sheet_homography(img, timing, orientation)
+        if located is None:
+            return WarpedSheet(img, marker_confidence=0.0)
+        warp_matrix, size, confidence, orientation = located
+        if self._config.get("roi_warp", False):
+            return RoiSheet(img, warp_matrix, size, marker_confidence=confidence, orientation=orientation)
+        return WarpedSheet(self._warp_scan_area(img, warp_matrix, size, timing), marker_confidence=confidence,
+                           orientation=orientation)
+
+    def _sheet_homography(self, img, timing=NULL_TIMING, orientation=None):
+        """
+        Finds the markers of a scan and returns the homography mapping it onto the scan area, the (width, height) of
+        the scan area, the confidence in the markers and the orientation the sheet is read in. Returns None if a
+        marker is missing.
+
+        An orientation of 180 reads the sheet upside down. The turn is part of the homography, so an upside down scan
+        is warped once like any other. If no orientation is given it's detected, unless detect_orientation is off.
+        """
+        img_height, img_width, img_channels = img.shape
+        levels = self._config.get("pyramid_levels", 0)
+        if levels:
+            scale = 2 ** levels
+            with timing.stage("downscale"):
+                small = cv2.resize(img, (img_width // scale, img_height // scale), interpolation=cv2.INTER_AREA)
+            with timing.stage("markers"):
+                found = self._find_corners(small, timing)
+            if found is None:
+                return None
+            corners, confidence = found
+            with timing.stage("refine_corners"):
+                corners = [self._refine_corner(img, i, (x * scale, y * scale), 4 * scale + 8)
+                           for i, (x, y) in enumerate(corners)]
+        else:
+            with timing.stage("markers"):
+                found = self._find_corners(img, timing)
+            if found is None:
+                return None
+            corners, confidence = found
+
+        if orientation is None:
+            orientation = 0
+            if self._config.get("detect_orientation", True):
+                with timing.stage("orientation"):
+                    orientation = 180 if self._upside_down(img, corners) else 0
+        if orientation == 180:
+            corners = corners[::-1]  # The lower right marker is the upper left one of the turned sheet, and so on.
+
+        decode_dpi = self._config.get("decode_dpi")
+        if decode_dpi:
+            img_width, img_height = int(self.SHEET_WIDTH * decode_dpi), int(self.SHEET_HEIGHT * decode_dpi)
 
-    def _crop_scan_area(self, img):
-        img2 = img[:]
-        img2 = self._round_colours(img2)
-        img_height, img_width, img_channels = img2.shape
+        new_points = ((0, 0), (img_width, 0), (0, img_height), (img_width, img_height))
+        warp_matrix = cv2.getPerspectiveTransform(np.float32(corners), np.float32(new_points))
+        return warp_matrix, (img_width, img_height), confidence, orientation
+
+    def _upside_down(self, img, corners):
+        """
+        Tells whether a scan is of an upside down sheet. The markers look the same both ways up, but the ink on a
+        filled in sheet is in its boxes: the scan area is warped small and the sheet is upside down if the boxes of
+        the template turned around hold several times more ink than the boxes the right way up. A blank sheet, or
+        one that isn't of this template, is taken to be the right way up.
+        """
+        width, height = int(self.SHEET_WIDTH * self.ORIENTATION_DPI), int(self.SHEET_HEIGHT * self.ORIENTATION_DPI)
+        new_points = ((0, 0), (width, 0), (0, height), (width, height))
+        warp_matrix = cv2.getPerspectiveTransform(np.float32(corners), np.float32(new_points))
+        small = self._warp_scan_area(img, warp_matrix, (width, height))
+        integral = integral_image(threshold_image(small))
+
+        rects = self.get_template().pixel_rects(width, height)
+        turned = np.column_stack([width - rects[:, 0] - rects[:, 2], height - rects[:, 1] - rects[:, 3], rects[:, 2:]])
+        upright_ink, turned_ink = 255 - sample_boxes(integral, rects), 255 - sample_boxes(integral, turned)
+        readable = np.isfinite(upright_ink) & np.isfinite(turned_ink)
+        if not readable.any():
+            return False
+        return turned_ink[readable].mean() > self.ORIENTATION_MIN_RATIO * max(upright_ink[readable].mean(), 1.0)
+
+    @staticmethod
+    def _corner_scores(xs, ys, img_width, img_height):
+        """
+        Per-point scores for the upper left, upper right, lower left and lower right corners, lowest wins.
+        """
+        return [xs + ys, (img_width - xs) + ys, xs + (img_height - ys), -(xs + ys)]
+
+    def _marker_mask(self, img, timing=NULL_TIMING):
+        with timing.stage("round_colours"):
+            img2 = self._round_colours(img)
 
         hue_target = list(cv2.cvtColor(np.array([[self._marker_colour]]).astype(np.uint8), cv2.COLOR_RGB2HSV)[0, 0])
         if hue_target[0] < 10 or hue_target[0] > 170:
@@ -218,60 +183,95 @@ class Scanner(ScannerBase):
             target_colour = self._marker_colour
 
         mask_range = self._get_colour_mask_range(*(target_colour + [50]))
-        mask = cv2.inRange(img_hsv, *mask_range)
-        res = cv2.bitwise_and(img, img, mask=mask)
-
-        edged = cv2.Canny(res, 100, 200)
-        edged = cv2.blur(edged, (5, 5))
-
-        (_, contours, _) = cv2.findContours(edged.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)[:4]  # grab the 4 biggest contours.
-        cv2.drawContours(res, contours, -1, (0, 255, 0), 3)
-
-        upper_left_box = []
-        upper_right_box = []
-        lower_left_box = []
-        lower_right_box = []
-
-        for cnt in contours:
-            for e in cnt:
-                for d in e:
-                    if d[0] < (img_width / 2) and d[1] < (img_height / 2):
-                        upper_left_box.append([d[0], d[1]])
-                    if d[0] > (img_width / 2) and d[1] < (img_height / 2):
-                        upper_right_box.append([img_width - d[0], d[1]])
-                    if d[0] < (img_width / 2) and d[1] > (img_height / 2):
-                        lower_left_box.append([d[0], img_height - d[1]])
-                    if d[0] > (img_width / 2) and d[1] > (img_height / 2):
-                        lower_right_box.append([d[0], d[1]])
-
-        if not all([upper_left_box, upper_right_box, lower_left_box, lower_right_box]):
-            print(Exception("Not enough corners!", upper_left_box, upper_right_box, lower_left_box, lower_right_box))
-            return img
-
-        selected_points = []
-        upper_left_point = sorted(upper_left_box, key=lambda pt: sum(pt))[0]
-        selected_points.append(upper_left_point)
-
-        upper_right_point = sorted(upper_right_box, key=lambda pt: sum(pt))[0]
-        upper_right_point = [img_width - upper_right_point[0], upper_right_point[1]]
-        selected_points.append(upper_right_point)
-
-        lower_left_point = sorted(lower_left_box, key=lambda pt: sum(pt))[0]
-        lower_left_point = [lower_left_point[0], img_height - lower_left_point[1]]
-        selected_points.append(lower_left_point)
-
-        lower_right_point = sorted(lower_right_box, key=lambda pt: sum(pt), reverse=True)[0]
-        selected_points.append(lower_right_point)
-
-        if len(selected_points) != 4:
-            print(Exception("Wrong number of corner points!", selected_points))
-            return img
-
-        new_points = ((0, 0), (img_width, 0), (0, img_height), (img_width, img_height))
-        new_points = sorted(new_points, key=lambda e: sum(e))
-        selected_points = sorted(selected_points, key=lambda e: sum(e))
-        warp_matrix = cv2.getPerspectiveTransform(np.float32(selected_points), np.float32(new_points))
-        cropped_img = cv2.warpPerspective(img[:], warp_matrix, (img_width, img_height),
-                                          borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
-        return cropped_img
+        return cv2.inRange(img_hsv, *mask_range)
+
+    def _find_corners(self, img, timing=NULL_TIMING):
+        """
+        Finds the outer corner of each of the four markers, in the order upper left, upper right, lower left, lower
+        right, along with a 0 to 1 confidence in them. Returns None if a marker is missing.
+
+        Markers are the connected blobs of marker colour that are the right size to be a marker. In each quadrant the
+        most square and solid one is taken, and its outermost pixel is refined to a sub-pixel corner. The confidence
+        is the lowest squareness or solidity of the four markers, lowered further if the corners don't have the
+        sheet's aspect ratio.
+        """
+        img_height, img_width, img_channels = img.shape
+        mask = self._marker_mask(img, timing)
+        if hasattr(cv2, 'connectedComponentsWithStatsWithAlgorithm'):  # OpenCV 3.3+, Grana's labelling is fastest here
+            count, labels, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S,
+                                                                                            cv2.CCL_GRANA)
+        else:
+            count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+        dpi = min(max(img_width, img_height) / max(self.SHEET_WIDTH, self.SHEET_HEIGHT),
+                  min(img_width, img_height) / min(self.SHEET_WIDTH, self.SHEET_HEIGHT))
+        expected_area = (self._config["marker_size"] * dpi) ** 2
+        lefts, tops = stats[1:, cv2.CC_STAT_LEFT], stats[1:, cv2.CC_STAT_TOP]
+        widths, heights = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT]
+        areas = stats[1:, cv2.CC_STAT_AREA].astype(np.float64)
+        quality = np.minimum(np.minimum(widths, heights) / np.maximum(widths, heights), areas / (widths * heights))
+        min_area, max_area = [expected_area * fraction for fraction in self.MARKER_AREA_RANGE]
+        candidates = (areas > min_area) & (areas < max_area) & (quality >= self.MARKER_MIN_QUALITY)
+
+        xs, ys = centroids[1:, 0], centroids[1:, 1]
+        left, right = xs < img_width / 2, xs > img_width / 2
+        top, bottom = ys < img_height / 2, ys > img_height / 2
+        quadrants = [left & top, right & top, left & bottom, right & bottom]
+        if not all((candidates & quadrant).any() for quadrant in quadrants):
+            print(Exception("Not enough corners!", [int((candidates & quadrant).sum()) for quadrant in quadrants]))
+            return None
+
+        corners = []
+        qualities = []
+        for corner, quadrant in enumerate(quadrants):
+            index = np.flatnonzero(candidates & quadrant)
+            index = index[np.argmax(quality[index])]
+            x0, y0 = lefts[index], tops[index]
+            blob_ys, blob_xs = np.nonzero(labels[y0:y0 + heights[index], x0:x0 + widths[index]] == index + 1)
+            blob_xs, blob_ys = blob_xs.astype(np.int64) + x0, blob_ys.astype(np.int64) + y0
+            best = np.argmin(self._corner_scores(blob_xs, blob_ys, img_width, img_height)[corner])
+            corners.append(self._subpixel_corner(mask, (int(blob_xs[best]), int(blob_ys[best]))))
+            qualities.append(float(quality[index]))
+
+        upper_left, upper_right, lower_left, lower_right = [np.array(corner) for corner in corners]
+        width = (np.linalg.norm(upper_right - upper_left) + np.linalg.norm(lower_right - lower_left)) / 2
+        height = (np.linalg.norm(lower_left - upper_left) + np.linalg.norm(lower_right - upper_right)) / 2
+        aspect = (width / height) / (self.SHEET_WIDTH / self.SHEET_HEIGHT) if height else 0
+        return corners, min(qualities + [min(aspect, 1 / aspect) if aspect else 0.0])
+
+    @staticmethod
+    def _subpixel_corner(mask, point, radius=6):
+        """
+        Refines the outermost pixel of a marker to its sub-pixel corner. Keeps the pixel if the marker is too close
+        to the edge of the mask to refine or the refinement wanders off.
+        """
+        x, y = point
+        mask_height, mask_width = mask.shape
+        if x < radius or y < radius or x + radius >= mask_width or y + radius >= mask_height:
+            return [float(x), float(y)]
+        window = mask[y - radius:y + radius + 1, x - radius:x + radius + 1]
+        refined = np.array([[[radius, radius]]], dtype=np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.01)
+        cv2.cornerSubPix(window, refined, (3, 3), (-1, -1), criteria)
+        dx, dy = refined[0, 0] - radius
+        if max(abs(dx), abs(dy)) > 2:
+            return [float(x), float(y)]
+        return [float(x + dx), float(y + dy)]
+
+    def _refine_corner(self, img, corner, point, radius):
+        """
+        Moves a coarse corner to the outermost marker pixel inside a full resolution window around it, refined to a
+        sub-pixel corner.
+        """
+        img_height, img_width, img_channels = img.shape
+        x, y = int(point[0]), int(point[1])
+        x0, y0 = max(x - radius, 0), max(y - radius, 0)
+        window = img[y0:min(y + radius, img_height), x0:min(x + radius, img_width)]
+        window_mask = self._marker_mask(window)
+        ys, xs = np.nonzero(window_mask)
+        if not len(xs):
+            return [float(x), float(y)]
+        scores = self._corner_scores(xs.astype(np.int64) + x0, ys.astype(np.int64) + y0, img_width, img_height)
+        best = np.argmin(scores[corner])
+        refined_x, refined_y = self._subpixel_corner(window_mask, (int(xs[best]), int(ys[best])))
+        return [refined_x + x0, refined_y + y0]
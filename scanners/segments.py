@@ -0,0 +1,40 @@
+import numpy as np
+
+SEGMENT_BITS = 1 << np.arange(7)
+
+
+def pack_segments(segments):
+    """
+    Packs an (N, 7) array of segment booleans into N 7-bit codes, segment i being bit i.
+    """
+    return np.asarray(segments, dtype=np.int64).reshape(-1, 7).dot(SEGMENT_BITS)
+
+
+def build_lookup_tables(*models):
+    """
+    Builds 128-entry tables mapping every segment code to its exact digit (-1 if none), its nearest digit by Hamming
+    distance (-1 if two digits are equally near) and a confidence in that nearest digit.
+
+    Confidence is (d2 - d1) / d2, d1 being the distance to the nearest digit and d2 the distance to the nearest
+    different digit, so an exact match is 1 and a tie is 0.
+    """
+    digit_codes = [[] for _ in range(10)]
+    for model in models:
+        for digit, segments in enumerate(model):
+            if segments is not None:
+                digit_codes[digit].append(int(pack_segments(segments)[0]))
+
+    codes = np.arange(128)
+    distances = np.empty((10, 128), dtype=np.int64)
+    for digit in range(10):
+        bit_diffs = codes[None, :] ^ np.array(digit_codes[digit])[:, None]
+        distances[digit] = np.array([[bin(x).count('1') for x in row] for row in bit_diffs]).min(axis=0)
+
+    ranked = np.sort(distances, axis=0)
+    nearest_distance, second_distance = ranked[0], ranked[1]
+    nearest = np.argmin(distances, axis=0)
+    nearest[nearest_distance == second_distance] = -1
+    exact = np.where(nearest_distance == 0, nearest, -1)
+    confidence = np.zeros(128)
+    np.divide(second_distance - nearest_distance, second_distance, out=confidence, where=second_distance > 0)
+    return exact, nearest, confidence
@@ -0,0 +1,104 @@
+import hashlib
+import json
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import numpy as np
+
+FieldPlan = namedtuple('FieldPlan', ['id', 'type', 'field', 'start', 'stop', 'image_rect'])
+
+
+class SheetTemplate(object):
+    """
+    A fields list and sheet config compiled into the rect of every box on the sheet and a decode plan per field.
+    Box rects are (x, y, width, height) in inches, pixel rects are cached per warped image size.
+    """
+
+    MAX_CACHED_SIZES = 8
+
+    def __init__(self, scan_fields, sheet_config, layout, key=None):
+        self.fields = scan_fields
+        self.config = sheet_config
+        self.key = key
+        self.sheet_size = (layout.SHEET_WIDTH, layout.SHEET_HEIGHT)
+
+        rects = []
+        self.plans = []
+        for field in scan_fields:
+            boxes = layout.field_boxes(field, sheet_config)
+            image_rect = layout.image_box(field, sheet_config) if field["type"] == "Image" else None
+            self.plans.append(FieldPlan(field["id"], field["type"], field, len(rects), len(rects) + len(boxes),
+                                        image_rect))
+            rects += boxes
+
+        self.rects = np.array(rects, dtype=np.float64).reshape(-1, 4)
+        self._pixel_rects = OrderedDict()
+        self._lock = Lock()
+
+    def xy_factors(self, img_width, img_height):
+        return img_width / self.sheet_size[0], img_height / self.sheet_size[1]
+
+    def pixel_rects(self, img_width, img_height):
+        """
+        Every box rect scaled to an image of the given size, as an (N, 4) int array.
+        """
+        size = (img_width, img_height)
+        with self._lock:
+            rects = self._pixel_rects.get(size)
+            if rects is None:
+                factors = np.array(self.xy_factors(img_width, img_height) * 2)
+                rects = self._pixel_rects[size] = (self.rects * factors).astype(np.int64)
+                while len(self._pixel_rects) > self.MAX_CACHED_SIZES:
+                    self._pixel_rects.popitem(last=False)
+        return rects
+
+    def pixel_image_rect(self, plan, img_width, img_height):
+        """
+        The ((x1, y1), (x2, y2)) pixel corners of an Image field.
+        """
+        x_factor, y_factor = self.xy_factors(img_width, img_height)
+        x, y, width, height = plan.image_rect
+        return (int(x * x_factor), int(y * y_factor)), (int((x + width) * x_factor), int((y + height) * y_factor))
+
+
+_templates = OrderedDict()
+_file_cache = {}
+
+
+def _content_hash(*blobs):
+    digest = hashlib.sha1()
+    for blob in blobs:
+        digest.update(blob)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def get_template(scan_fields, sheet_config, layout):
+    """
+    Returns the compiled template for a fields list and config, compiling it only if its content is new.
+    """
+    key = (layout.__name__, _content_hash(json.dumps(scan_fields, sort_keys=True).encode(),
+                                          json.dumps(sheet_config, sort_keys=True).encode()))
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = SheetTemplate(scan_fields, sheet_config, layout, key)
+        while len(_templates) > 16:
+            _templates.popitem(last=False)
+    return template
+
+
+def load_template(fields_path, config_path, layout):
+    """
+    Loads a fields file and config file into a template, only parsing them again when their content changes.
+    """
+    with open(fields_path, 'rb') as f:
+        fields_blob = f.read()
+    with open(config_path, 'rb') as f:
+        config_blob = f.read()
+    key = (layout.__name__, fields_path, config_path)
+    content_hash = _content_hash(fields_blob, config_blob)
+    cached = _file_cache.get(key)
+    if cached is None or cached[0] != content_hash:
+        template = get_template(json.loads(fields_blob.decode()), json.loads(config_blob.decode()), layout)
+        _file_cache[key] = cached = (content_hash, template)
+    return cached[1]
@@ -0,0 +1,122 @@
+import csv
+import json
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import Lock
+
+
+class SheetTiming(object):
+    """
+    Wall time spent in each stage of scanning one sheet. Time spent in a stage more than once, like a field decoder
+    used by several fields, adds up. Stages can be nested, e.g. round_colours is also counted in markers.
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.time()
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, stage_name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage_name, time.perf_counter() - start)
+
+    def add(self, stage_name, seconds):
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    @property
+    def total(self):
+        return self.stages.get("scan", sum(self.stages.values()))
+
+
+class _NullTiming(object):
+    """
+    Stands in for a SheetTiming when nothing's being timed.
+    """
+
+    @contextmanager
+    def stage(self, stage_name):
+        yield
+
+    def add(self, stage_name, seconds):
+        pass
+
+
+NULL_TIMING = _NullTiming()
+
+
+class ScanStats(object):
+    """
+    Keeps the stage timings of the last few sheets scanned for a rolling summary, and optionally logs every sheet's
+    timings to a .csv (one row per stage) or .jsonl (one line per sheet) file.
+    """
+
+    def __init__(self, window=50, log_path=None):
+        self._sheets = deque(maxlen=window)
+        self._lock = Lock()
+        self._log_path = log_path
+        self._log_file = None
+        self._csv = None
+        self.count = 0
+
+    def record(self, timing):
+        with self._lock:
+            self._sheets.append(timing)
+            self.count += 1
+            if self._log_path:
+                try:
+                    self._log(timing)
+                except (IOError, OSError) as ex:
+                    print(ex)
+
+    def _log(self, timing):
+        if self._log_file is None:
+            self._log_file = open(self._log_path, 'a', newline='')
+            if not self._log_path.endswith('.jsonl'):
+                self._csv = csv.writer(self._log_file)
+                if self._log_file.tell() == 0:
+                    self._csv.writerow(['time', 'sheet', 'stage', 'ms'])
+        if self._csv is not None:
+            for stage_name, seconds in timing.stages.items():
+                self._csv.writerow([round(timing.started, 3), timing.name, stage_name, round(seconds * 1000, 3)])
+        else:
+            self._log_file.write(json.dumps({
+                'time': round(timing.started, 3),
+                'sheet': timing.name,
+                'ms': OrderedDict((k, round(v * 1000, 3)) for k, v in timing.stages.items())
+            }) + '\n')
+        self._log_file.flush()
+
+    def summary(self):
+        """
+        Mean milliseconds per sheet spent in each stage over the rolling window, slowest first.
+        """
+        with self._lock:
+            sheets = list(self._sheets)
+        totals = OrderedDict()
+        for timing in sheets:
+            for stage_name, seconds in timing.stages.items():
+                totals[stage_name] = totals.get(stage_name, 0.0) + seconds
+        means = [(stage_name, 1000 * seconds / len(sheets)) for stage_name, seconds in totals.items()]
+        return OrderedDict(sorted(means, key=lambda item: item[1], reverse=True))
+
+    def summary_text(self, max_stages=5):
+        summary = self.summary()
+        if not summary:
+            return ""
+        total = summary.pop("scan", None)
+        text = ", ".join("{} {:.0f}".format(k, v) for k, v in list(summary.items())[:max_stages])
+        if total is not None:
+            text = "{:.0f} ms/sheet ({})".format(total, text)
+        return text + " over {} sheets".format(min(self.count, self._sheets.maxlen))
+
+    def close(self):
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+                self._csv = None
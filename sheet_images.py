@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+import cv2
+
+
+class SheetImages(object):
+    """
+    The images of the sheet being reviewed. Holds the raw scan without copying it and derives the marked and
+    display-resolution views from it only when they're asked for. Derived views are kept in a small LRU cache so
+    flipping between views is free, and everything is dropped with the object when the next sheet comes in.
+    orientation is the way up the scan was decoded, 180 if it was read upside down.
+    """
+
+    MAX_CACHED = 8
+
+    def __init__(self, raw, render_marked=None, orientation=0):
+        self.raw = raw
+        self.orientation = orientation
+        self._render_marked = render_marked
+        self._cache = OrderedDict()
+
+    def derive(self, key, factory):
+        """
+        Returns the cached value for a key, making it with factory() if it isn't cached.
+        """
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = factory()
+            while len(self._cache) > self.MAX_CACHED:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return value
+
+    @property
+    def marked(self):
+        """
+        The decoded sheet with every box marked, or the raw scan if the sheet wasn't decoded.
+        """
+        return self.derive('marked', self._render_marked) if self._render_marked is not None else self.raw
+
+    def view(self, name):
+        return self.raw if name == 'raw' else self.marked
+
+    def preview(self, name, size):
+        """
+        A view scaled down to fit the given (width, height), or the view itself if it's already small enough.
+        """
+        def downscale():
+            img = self.view(name)
+            height, width = img.shape[:2]
+            if min(size) > 0 and (width > size[0] or height > size[1]):
+                return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+            return img
+        return self.derive(('preview', name, size), downscale)
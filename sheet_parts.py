@@ -0,0 +1,127 @@
+import re
+import zipfile
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+
+_ROW = re.compile(rb'<row r="(\d+)"[^>]*?(?:/>|>.*?</row>)')
+_SHARED_STRING_CELL = re.compile(rb'(<c r="[A-Z]+\d+"(?: s="\d+")?) t="s"><v>(\d+)</v></c>')
+_SHARED_STRING = re.compile(rb'<si>(.*?)</si>')
+_DIMENSION = re.compile(rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)\d+("/>)')
+
+SheetPart = namedtuple('SheetPart', ['signature', 'row_keys', 'rows', 'xml', 'names', 'hidden', 'dynamic_arrays'])
+PlannedSheet = namedtuple('PlannedSheet', ['index', 'signature', 'row_keys', 'whole', 'kept_rows', 'names', 'hidden',
+                                           'dynamic_arrays'])
+
+
+class SheetPartCache(object):
+    """
+    The worksheet XML of the last workbook built, so the next build can put back the sheets whose inputs haven't
+    changed instead of drawing them again. xlsxwriter can only write whole workbooks, so a build draws the sheets
+    that changed and the kept ones are swapped into the file it made.
+
+    A sheet is kept whole if its signature, made from the inputs it's drawn from, is the same. A sheet with a row
+    per entry also has a key for each row, and the leading rows whose keys didn't change are kept even when others
+    changed or were added after them, so only those are drawn. Kept sheets have their shared strings written inline
+    so they don't depend on the shared string table of the build they came from. They do depend on its style
+    indices, so every build must give its formats their indices in the same order before anything is drawn, and on
+    whether the workbook has the metadata part that dynamic array formulas point at.
+
+    This depends on how XlsxWriter lays out and indexes what it writes, and on private parts of it the generator
+    uses (Format._get_xf_index, Format._get_dxf_index and Worksheet.has_dynamic_arrays). It's only been checked
+    against the XlsxWriter version pinned in requirements.txt (3.2.9): check that incremental builds still match
+    full builds before upgrading it.
+    """
+
+    def __init__(self):
+        self._parts = {}
+        self._planned = OrderedDict()
+
+    def start(self):
+        self._planned = OrderedDict()
+
+    def plan(self, name, index, signature, row_keys=None):
+        """
+        Looks up a sheet that goes at the given index of the workbook being built. Returns whether it's kept whole
+        and, if it isn't, how many of its rows after the header are kept and don't need drawing.
+        """
+        part = self._parts.get(name)
+        whole, kept_rows = False, 0
+        if part is not None and part.signature == signature:
+            if row_keys is None or part.row_keys is None:
+                whole = row_keys is None and part.row_keys is None
+            else:
+                for old_key, new_key in zip(part.row_keys, row_keys):
+                    if old_key != new_key:
+                        break
+                    kept_rows += 1
+                whole = kept_rows == len(row_keys) == len(part.row_keys)
+        if whole:
+            kept_rows = 0
+            names, hidden = part.names, part.hidden
+        else:
+            names, hidden = [], False
+        dynamic_arrays = (whole or kept_rows > 0) and part.dynamic_arrays
+        self._planned[name] = PlannedSheet(index, signature, row_keys, whole, kept_rows, names, hidden, dynamic_arrays)
+        return whole, kept_rows
+
+    def all_whole(self):
+        return bool(self._planned) and all(sheet.whole for sheet in self._planned.values())
+
+    def kept_sheet(self, name):
+        """
+        The (name, formula) defined names of a sheet kept whole, to define again, whether it's hidden, and whether
+        what's kept of it has dynamic array formulas.
+        """
+        sheet = self._planned[name]
+        return sheet.names, sheet.hidden, sheet.dynamic_arrays
+
+    def drawn(self, name, names, hidden):
+        """
+        Records the defined names and visibility of a sheet once it's drawn.
+        """
+        self._planned[name] = self._planned[name]._replace(names=list(names), hidden=hidden)
+
+    def assemble(self, xlsx, filename):
+        """
+        Writes the workbook xlsxwriter built in memory to a file with the kept sheets and rows put back into it, then
+        keeps its sheets for the next build.
+        """
+        with zipfile.ZipFile(BytesIO(xlsx)) as source:
+            member_names = source.namelist()
+            members = dict((member, source.read(member)) for member in member_names)
+        shared_strings = _SHARED_STRING.findall(members.get('xl/sharedStrings.xml', b''))
+
+        parts = {}
+        for name, sheet in self._planned.items():
+            path = 'xl/worksheets/sheet{}.xml'.format(sheet.index + 1)
+            if sheet.whole:
+                parts[name] = self._parts[name]
+                members[path] = parts[name].xml
+                continue
+            xml = members[path]
+            if sheet.kept_rows:
+                xml = members[path] = self._put_back_rows(xml, self._parts[name].rows[:sheet.kept_rows])
+            if 'xl/worksheets/_rels/sheet{}.xml.rels'.format(sheet.index + 1) in members:
+                continue  # Links, images and charts depend on other parts of the workbook.
+            xml = _SHARED_STRING_CELL.sub(lambda m: m.group(1) + b' t="inlineStr"><is>' +
+                                          shared_strings[int(m.group(2))] + b'</is></c>', xml)
+            rows = [row.group(0) for row in _ROW.finditer(xml) if int(row.group(1)) > 1]
+            parts[name] = SheetPart(sheet.signature, sheet.row_keys, rows, xml, sheet.names, sheet.hidden,
+                                    b' cm="' in xml)
+
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as target:
+            for member in member_names:
+                target.writestr(member, members[member])
+        self._parts = parts
+        self._planned = OrderedDict()
+
+    @staticmethod
+    def _put_back_rows(xml, rows):
+        """
+        Puts kept rows back after the header row of a sheet drawn without them, and stretches its dimension over
+        them.
+        """
+        header = next(row for row in _ROW.finditer(xml) if row.group(1) == b'1')
+        xml = xml[:header.end()] + b''.join(rows) + xml[header.end():]
+        last_row = max(int(row.group(1)) for row in _ROW.finditer(xml))
+        return _DIMENSION.sub(lambda m: m.group(1) + str(last_row).encode() + m.group(2), xml, count=1)
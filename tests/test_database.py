@@ -0,0 +1,73 @@
+import json
+import sqlite3
+
+import pytest
+
+from database import ScoutingDatabase
+
+
+def entry(team, match, pos, filename):
+    return {"team_number": team, "match": match, "pos": pos, "filename": filename}
+
+
+def test_replaces_an_entry_in_the_same_slot(tmp_path):
+    database = ScoutingDatabase(str(tmp_path / 'db.sqlite'))
+    assert database.read_only is None
+    assert database.upsert_entry('2017onto', entry(1114, 1, 0, 'a.jpg')) is None
+    assert database.upsert_entry('2017onto', entry(2056, 1, 0, 'b.jpg')) == 'a.jpg'
+    assert [e["filename"] for e in database.event_entries('2017onto')] == ['b.jpg']
+    database.delete_entry('2017onto', 'b.jpg')
+    assert database.event_entries('2017onto') == []
+    database.close()
+
+
+def test_reads_but_never_writes_a_table_synced_from_clooney(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE scouting_entries (id INTEGER PRIMARY KEY, data TEXT, event TEXT, team INTEGER, '
+               'match INTEGER, pos INTEGER, filename TEXT, extra TEXT)')
+    db.execute('INSERT INTO scouting_entries (data, event) VALUES (?, ?)', (json.dumps(entry(1114, 1, 0, 'a.jpg')),
+                                                                          '2017onto'))
+    db.commit()
+
+    database = ScoutingDatabase(path)
+    assert database.read_only is not None
+    assert [e["filename"] for e in database.event_entries('2017onto')] == ['a.jpg']
+    db.execute('UPDATE scouting_entries SET data = ?', (json.dumps(entry(1114, 1, 0, 'b.jpg')),))
+    db.commit()
+    assert [e["filename"] for e in database.event_entries('2017onto')] == ['b.jpg']
+
+    with pytest.raises(sqlite3.DatabaseError):
+        database.upsert_entry('2017onto', entry(2056, 2, 0, 'c.jpg'))
+    with pytest.raises(sqlite3.DatabaseError):
+        database.delete_entry('2017onto', 'b.jpg')
+    assert db.execute('SELECT COUNT(*) FROM scouting_entries').fetchone()[0] == 1
+    assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'index'").fetchone()[0] == 0
+    database.close()
+
+
+def test_reads_but_never_writes_a_table_with_two_entries_in_a_slot(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    ScoutingDatabase(path).close()
+    db = sqlite3.connect(path)
+    db.execute('DROP INDEX scouting_entries_slot')
+    for filename in ['a.jpg', 'b.jpg']:
+        db.execute('INSERT INTO scouting_entries (event, team, match, pos, filename, data, last_modified) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?)', ('2017onto', 1114, 1, 0, filename, '{}', 1.0))
+    db.commit()
+
+    database = ScoutingDatabase(path)
+    assert database.read_only is not None
+    assert len(database.event_entries('2017onto')) == 2
+    with pytest.raises(sqlite3.DatabaseError):
+        database.upsert_entry('2017onto', entry(1114, 1, 0, 'c.jpg'))
+    database.close()
+
+
+def test_refuses_a_table_without_entries(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE scouting_entries (id INTEGER PRIMARY KEY, event TEXT)')
+    db.commit()
+    with pytest.raises(sqlite3.DatabaseError):
+        ScoutingDatabase(path)
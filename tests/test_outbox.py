@@ -0,0 +1,161 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock, Thread
+
+import pytest
+
+from outbox import UploadOutbox
+
+
+class FakeClooney(object):
+    """
+    A Clooney stand-in on localhost that fails the first `failures` posts with a 503, rejects entries marked
+    "reject" with a 400, and records every entry it accepts along with when each post arrived.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.received = []
+        self.post_times = []
+        self._lock = Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+                with fake._lock:
+                    fake.post_times.append(time.monotonic())
+                    if fake.failures > 0:
+                        fake.failures -= 1
+                        status = 503
+                    elif body.get("reject"):
+                        status = 400
+                    else:
+                        fake.received.append(body["n"])
+                        status = 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/api/sql/add_entry'.format(self._server.server_port)
+        self._thread = Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def clooney():
+    servers = []
+
+    def start(failures=0):
+        servers.append(FakeClooney(failures))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+def open_outbox(path, url, **kwargs):
+    kwargs.setdefault('min_backoff', 0.02)
+    kwargs.setdefault('max_backoff', 0.1)
+    return UploadOutbox(str(path), url, **kwargs)
+
+
+def wait_until_empty(outbox, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while outbox.status()[0]:
+        assert time.monotonic() < deadline, "Still queued: {}".format(outbox.status_text())
+        time.sleep(0.01)
+
+
+def test_retries_until_every_entry_is_delivered_once(tmp_path, clooney):
+    server = clooney(failures=3)
+    outbox = open_outbox(tmp_path / 'outbox.sqlite', server.url)
+    for n in range(25):
+        outbox.put({"n": n})
+    wait_until_empty(outbox)
+    assert outbox.status_text() == "Uploads up to date"
+    outbox.close()
+    assert server.received == list(range(25))
+    assert server.failures == 0
+
+
+def test_waits_longer_after_each_failure_in_a_row(tmp_path, clooney):
+    server = clooney(failures=4)
+    outbox = open_outbox(tmp_path / 'outbox.sqlite', server.url, min_backoff=0.05, max_backoff=0.15)
+    outbox.put({"n": 0})
+    wait_until_empty(outbox)
+    outbox.close()
+    gaps = [later - earlier for earlier, later in zip(server.post_times, server.post_times[1:])]
+    assert len(gaps) == 4
+    for gap, backoff in zip(gaps, [0.05, 0.1, 0.15, 0.15]):
+        assert gap >= backoff * 0.9
+
+
+def test_shows_the_last_error_while_waiting(tmp_path, clooney):
+    server = clooney(failures=1000)
+    outbox = open_outbox(tmp_path / 'outbox.sqlite', server.url)
+    outbox.put({"n": 0})
+    deadline = time.monotonic() + 5.0
+    while outbox.last_error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert outbox.status()[0] == 1
+    assert "HTTP 503" in outbox.status_text()
+    outbox.close()
+
+
+def test_drops_entries_clooney_rejects(tmp_path, clooney):
+    server = clooney()
+    outbox = open_outbox(tmp_path / 'outbox.sqlite', server.url)
+    outbox.put({"n": 0})
+    outbox.put({"n": 1, "reject": True})
+    outbox.put({"n": 2})
+    wait_until_empty(outbox)
+    outbox.close()
+    assert server.received == [0, 2]
+    assert len(server.post_times) == 3
+
+
+def test_sends_what_was_queued_when_reopened(tmp_path, clooney):
+    path = tmp_path / 'outbox.sqlite'
+    down = clooney(failures=1000)
+    outbox = open_outbox(path, down.url)
+    for n in range(10):
+        outbox.put({"n": n})
+    outbox.close()
+    assert down.received == []
+
+    up = clooney()
+    outbox = open_outbox(path, up.url)
+    assert outbox.status()[0] == 10
+    outbox.put({"n": 10})
+    wait_until_empty(outbox)
+    outbox.close()
+    assert up.received == list(range(11))
+
+
+def test_closing_mid_upload_sends_nothing_twice(tmp_path, clooney):
+    path = tmp_path / 'outbox.sqlite'
+    server = clooney(failures=2)
+    outbox = open_outbox(path, server.url, batch_size=5)
+    for n in range(200):
+        outbox.put({"n": n})
+    while not server.received:
+        time.sleep(0.001)
+    outbox.close()
+
+    outbox = open_outbox(path, server.url, batch_size=5)
+    wait_until_empty(outbox)
+    outbox.close()
+    assert server.received == list(range(200))
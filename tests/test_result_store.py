@@ -0,0 +1,74 @@
+import json
+
+from result_store import ResultStore, open_result_store
+
+
+def test_entries_survive_reopening(tmp_path):
+    path = str(tmp_path / 'data.jsonl')
+    store = ResultStore(path)
+    for n in range(3):
+        store.append({"n": n})
+    store.close()
+
+    store = ResultStore(path)
+    assert len(store) == 3
+    assert store.entries() == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert store.last() == {"n": 2}
+    store.close()
+
+
+def test_drops_a_partly_written_last_line(tmp_path):
+    path = tmp_path / 'data.jsonl'
+    store = ResultStore(str(path))
+    store.append({"n": 0})
+    store.append({"n": 1})
+    store.close()
+    with open(str(path), 'ab') as f:
+        f.write(b'{"n": 2, "filena')
+    whole_size = len(b'{"n": 0}\n{"n": 1}\n')
+
+    store = ResultStore(str(path))
+    assert path.stat().st_size == whole_size
+    assert store.entries() == [{"n": 0}, {"n": 1}]
+    store.append({"n": 3})
+    store.close()
+
+    store = ResultStore(str(path))
+    assert store.entries() == [{"n": 0}, {"n": 1}, {"n": 3}]
+    store.close()
+
+
+def test_appends_after_a_pop_replace_the_popped_entry(tmp_path):
+    path = str(tmp_path / 'data.jsonl')
+    store = ResultStore(path)
+    store.append({"n": 0, "notes": "a longer entry than the one after it"})
+    store.append({"n": 1, "notes": "another long entry"})
+    assert store.pop() == {"n": 1, "notes": "another long entry"}
+    store.append({"n": 2})
+    assert store.entries() == [{"n": 0, "notes": "a longer entry than the one after it"}, {"n": 2}]
+    assert store.pop() == {"n": 2}
+    assert store.pop() == {"n": 0, "notes": "a longer entry than the one after it"}
+    assert store.pop() is None
+    assert store.last() is None
+    store.append({"n": 3})
+    store.close()
+
+    store = ResultStore(path)
+    assert store.entries() == [{"n": 3}]
+    store.close()
+    with open(path) as f:
+        assert f.read() == '{"n": 3}\n'
+
+
+def test_imports_an_old_data_json_once(tmp_path):
+    json_path = tmp_path / 'data.json'
+    json_path.write_text(json.dumps([{"n": 0}, {"n": 1}]))
+    store = open_result_store(str(json_path))
+    assert store.entries() == [{"n": 0}, {"n": 1}]
+    store.append({"n": 2})
+    store.close()
+
+    store = open_result_store(str(json_path))
+    assert store.entries() == [{"n": 0}, {"n": 1}, {"n": 2}]
+    store.close()
+    assert json.loads(json_path.read_text()) == [{"n": 0}, {"n": 1}]
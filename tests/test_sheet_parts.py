@@ -0,0 +1,135 @@
+import zipfile
+from io import BytesIO
+
+import pytest
+import xlsxwriter
+
+from sheet_parts import SheetPartCache, _SHARED_STRING, _SHARED_STRING_CELL
+
+
+def build(cache, path, entries, teams):
+    """
+    Builds a two sheet workbook the way SpreadsheetGenerator does: a sheet with a row per entry, keyed by each
+    entry's id and stamp, and a sheet drawn from the team list as a whole. Returns False if nothing was written.
+    """
+    cache.start()
+    entries_whole, kept_rows = cache.plan('entries', 0, 'layout', [(e['id'], e['stamp']) for e in entries])
+    teams_whole, _ = cache.plan('teams', 1, repr(teams))
+    if cache.all_whole():
+        return False
+
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    bold = workbook.add_format({'bold': True})
+    decimal = workbook.add_format({'num_format': '0.0'})
+    for workbook_format in (bold, decimal):
+        workbook_format._get_xf_index()
+        workbook_format._get_dxf_index()
+
+    sheet = workbook.add_worksheet('Entries')
+    if entries_whole:
+        for name, formula in cache.kept_sheet('entries')[0]:
+            workbook.define_name(name, formula)
+    else:
+        names = [('entry_teams', "='Entries'!A2:A{}".format(len(entries) + 1))]
+        sheet.write_row(0, 0, ['Team', 'Match', 'Notes', 'Score'], bold)
+        for row in range(kept_rows, len(entries)):
+            entry = entries[row]
+            sheet.write_row(row + 1, 0, [entry['team'], entry['match'], entry['notes']])
+            sheet.write_number(row + 1, 3, entry['score'], decimal)
+        for name, formula in names:
+            workbook.define_name(name, formula)
+        cache.drawn('entries', names, False)
+
+    sheet = workbook.add_worksheet('Teams')
+    if not teams_whole:
+        sheet.write(0, 0, 'Team', bold)
+        for row, team in enumerate(teams):
+            sheet.write(row + 1, 0, team)
+            sheet.write_formula(row + 1, 1, '=COUNTIF(Entries!A:A,A{})'.format(row + 2))
+        cache.drawn('teams', [], False)
+
+    workbook.close()
+    cache.assemble(output.getvalue(), path)
+    return True
+
+
+def contents(path):
+    """
+    The workbook and worksheet XML of an xlsx file, with shared strings written inline the way kept sheets have
+    them, so a sheet reads the same whichever build it came from.
+    """
+    with zipfile.ZipFile(path) as xlsx:
+        shared_strings = _SHARED_STRING.findall(xlsx.read('xl/sharedStrings.xml'))
+        return dict((member, _SHARED_STRING_CELL.sub(lambda m: m.group(1) + b' t="inlineStr"><is>' +
+                                                     shared_strings[int(m.group(2))] + b'</is></c>',
+                                                     xlsx.read(member)))
+                    for member in xlsx.namelist() if member.startswith('xl/worksheets/sheet')
+                    or member == 'xl/workbook.xml')
+
+
+def entry(entry_id, stamp=1.0, notes=None):
+    return {'id': entry_id, 'stamp': stamp, 'team': 1000 + entry_id % 7, 'match': entry_id // 6 + 1,
+            'notes': notes if notes is not None else 'note {}'.format(entry_id % 3), 'score': entry_id * 0.5}
+
+
+@pytest.fixture
+def check(tmp_path):
+    """
+    Builds into the same file with one cache over and over, and checks every build matches a full build of the same
+    entries and teams with a new cache.
+    """
+    cache = SheetPartCache()
+    path = str(tmp_path / 'incremental.xlsx')
+    builds = []
+
+    def step(entries, teams):
+        built = build(cache, path, entries, teams)
+        full_path = str(tmp_path / 'full{}.xlsx'.format(len(builds)))
+        assert build(SheetPartCache(), full_path, entries, teams)
+        assert contents(path) == contents(full_path)
+        builds.append(built)
+        return built
+    return step
+
+
+def test_adding_entries_matches_a_full_build(check):
+    teams = [1000, 1001, 1002]
+    entries = [entry(i) for i in range(10)]
+    assert check(entries, teams)
+    entries.append(entry(10, notes='a new note'))
+    assert check(entries, teams)
+    entries.extend(entry(i) for i in range(11, 20))
+    assert check(entries, teams)
+
+
+def test_replacing_entries_matches_a_full_build(check):
+    teams = [1000, 1001, 1002]
+    entries = [entry(i) for i in range(10)]
+    assert check(entries, teams)
+    entries[9] = entry(9, stamp=2.0, notes='edited last')
+    assert check(entries, teams)
+    entries[2] = entry(2, stamp=2.0, notes='edited early')
+    assert check(entries, teams)
+    assert check(entries, teams + [1003])
+
+
+def test_deleting_entries_matches_a_full_build(check):
+    teams = [1000, 1001, 1002]
+    entries = [entry(i) for i in range(10)]
+    assert check(entries, teams)
+    del entries[-1]
+    assert check(entries, teams)
+    del entries[4]
+    assert check(entries, teams)
+    del entries[:]
+    assert check(entries, teams)
+
+
+def test_nothing_is_written_when_nothing_changed(tmp_path):
+    cache = SheetPartCache()
+    path = str(tmp_path / 'incremental.xlsx')
+    entries = [entry(i) for i in range(5)]
+    assert build(cache, path, entries, [1000])
+    assert not build(cache, path, entries, [1000])
+    assert build(cache, path, entries, [1000, 1001])
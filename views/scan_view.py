@@ -1,21 +1,28 @@
-import glob
 import json
 import shutil
 import os
+import sqlite3
 import time
 
 import cv2
 import numpy as np
 from PyQt5 import uic
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-import requests
 
+from database import ScoutingDatabase
 from generator import SpreadsheetGenerator
+from outbox import UploadOutbox
+from prefetch import ScanPrefetcher
+from result_store import open_result_store
 from runners import Runner
 from scanners.scanner import Scanner
+from scanners.template import load_template
+from scanners.timing import ScanStats, SheetTiming
+from sheet_images import SheetImages
 from tba_py import TBA
+from watcher import ScanWatcher
 
 
 class ScanView(QMainWindow):
@@ -60,50 +67,82 @@ class ScanView(QMainWindow):
 
         self.event_id = event_id
         self.data_filepath = data_file
-        self.config = json.load(open(self.config_file))
-        self.field_list = json.load(open(self.fields_file))
+        self.results = open_result_store(data_file)
+        self.template = None
+        self.load_sheet_files()
         self.scan_dir = scan_dirpath
         self.clooney_host = clooney_host
+        self.outbox = UploadOutbox(os.path.splitext(data_file)[0] + '.outbox.sqlite',
+                                   'http://' + clooney_host + '/api/sql/add_entry')
 
         for sub_folder in ["Processed", "Rejected", "Marked", "images"]:
             if not os.path.isdir(self.scan_dir + sub_folder + "/"):
                 os.makedirs(self.scan_dir + sub_folder + "/")
-
-        self.fields = dict(zip(map(lambda x: x['id'], self.field_list), self.field_list))
+        self.watcher = ScanWatcher(self.scan_dir)
 
         self.scanner = Scanner(self.field_list, self.config, self.scan_dir + "images/")
-
-        self.generator = SpreadsheetGenerator('db.sqlite', self.tba)
+        self.scanner.set_template(self.template)
+        self.scan_stats = ScanStats(log_path=self.config.get("timing_log"))
+        self.scanner.set_stats(self.scan_stats)
+        self.prefetcher = ScanPrefetcher(self.scanner, depth=3)
+
+        self.database = None
+        self.generator = None
+        self.database_status = None
+        try:
+            self.generator = SpreadsheetGenerator('db.sqlite', self.tba)
+            if self.generator.database.read_only is None:
+                self.database = ScoutingDatabase('db.sqlite')
+            else:  # e.g. a scouting_entries table synced from Clooney, which the spreadsheet can still be built from.
+                self.database_status = "Not writing entries to db.sqlite: {}".format(self.generator.database.read_only)
+        except sqlite3.Error as ex:
+            self.database_status = "Not using db.sqlite or the spreadsheet: {}".format(ex)
         self.generator_runner = Runner('Generator', self.update_spreadsheet)
         self.last_updated = time.time()
         self.should_update_again = False
         self.generator_runner.run(run_anyway=True)
 
-        self.backup_img = np.zeros((1, 1, 3), np.uint8)
-        self.img = np.zeros((1, 1, 3), np.uint8)
-        self.raw_img = np.zeros((1, 1, 3), np.uint8)
-        self.current_img = np.zeros((1, 1, 3), np.uint8)
+        self.sheet = None
         self.selected_img = "img"
         self.filename = ""
         self.data_types = {}
         self.filepath_label_old_text = ""
         self.errors = []
 
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.update_status)
+        self.status_timer.start(1000)
+
         self.get_new_scan()
 
         self.show()
 
+    def read_next_scan(self):
+        files = self.watcher.pending()
+        selected_file = files[0]
+        self.filename = selected_file.split("/")[-1]
+        self.set_filepath_label_text(files[0])
+        prefetched = self.prefetcher.take(selected_file)
+        self.prefetcher.update(files[1:])
+        if prefetched is not None:
+            return prefetched
+        timing = SheetTiming(self.filename)
+        with timing.stage("read"):
+            raw_scan = self.scanner.read_scan(selected_file)
+        data, marked_sheet = self.scanner.scan_sheet(raw_scan, timing)
+        return raw_scan, data, marked_sheet
+
     def update_spreadsheet(self, delay=30, run_anyway=False):
         time_delta = time.time() - self.last_updated
         if time_delta > 60 or run_anyway:
             last_update = self.last_updated
             self.last_updated = time.time()
-            self.generator.create_spreadsheet_for_event(self.event_id)
-            try:
-                self.generator.upload_to_google_drive('Clooney.xlsx', 'Clooney {}'.format(self.event_id))
-            except:
-                print("Couldn't Upload Spreadsheet")
-            print("Updated Spreadsheet @ {}".format(self.last_updated))
+            if self.generator is not None and self.generator.create_spreadsheet_for_event(self.event_id):
+                try:
+                    self.generator.upload_to_google_drive('Clooney.xlsx', 'Clooney {}'.format(self.event_id))
+                except:
+                    print("Couldn't Upload Spreadsheet")
+                print("Updated Spreadsheet @ {}".format(self.last_updated))
             time.sleep(max(0, delay - (time.time() - last_update)))
             if self.should_update_again:
                 self.should_update_again = False
@@ -123,32 +162,28 @@ class ScanView(QMainWindow):
 
     def handle_img_click(self, event):
         if self.click_mode == "four_corners":
-            img_h, img_w = self.raw_img.shape[:-1]
+            img_h, img_w = self.sheet.raw.shape[:-1]
             w_scale = img_w / self.scan_preview.size().width()
             h_scale = img_h / self.scan_preview.size().height()
             x = int(event.x() * w_scale)
             y = int(event.y() * h_scale)
             self.corners.append((x, y))
-            cv2.rectangle(self.current_img, (x - 10, y - 10), (x+10, y+10), (0, 255, 0), thickness=10)
-            self.set_img(self.current_img)
+            self.show_sheet('raw', self.corners)
             if len(self.corners) == 4:
                 selected_points = sorted(self.corners, key=lambda l: sum(l))
                 new_points = ((200, 200), (img_w - 200, 200), (200, img_h - 200), (img_w - 200, img_h - 200))
                 new_points = sorted(new_points, key=lambda e: sum(e))
                 warp_matrix = cv2.getPerspectiveTransform(np.float32(selected_points), np.float32(new_points))
-                self.raw_img = cv2.warpPerspective(self.raw_img, warp_matrix, (img_w, img_h), borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
+                raw_img = cv2.warpPerspective(self.sheet.raw, warp_matrix, (img_w, img_h), borderMode=cv2.BORDER_CONSTANT, borderValue=(255, 255, 255))
                 self.reset_click_mode()
-                self.get_new_scan(self.raw_img)
+                self.get_new_scan(raw_img)
 
     def handle_toggle_view_button(self):
         if self.selected_img == 'img':
             self.selected_img = 'raw'
-            self.set_img(self.raw_img)
-            self.current_img = np.copy(self.raw_img)
         else:
             self.selected_img = 'img'
-            self.set_img(self.img)
-            self.current_img = np.copy(self.img)
+        self.show_sheet(self.selected_img)
 
     def set_filepath_label_text(self, text):
         self.filepath_label_old_text = self.filepath_label.text()
@@ -160,20 +195,17 @@ class ScanView(QMainWindow):
         else:
             self.set_filepath_label_text('Click on the 4 corners of the bounding box.')
             self.selected_img = 'raw'
-            self.set_img(self.raw_img)
+            self.show_sheet('raw')
             self.enable_inputs('four')
             self.corners = []
             self.scan_preview.setCursor(Qt.PointingHandCursor)
             self.click_mode = "four_corners"
 
     def handle_rotate_180_button(self):
-        img_h, img_w = self.img.shape[:-1]
-        warp_matrix = cv2.getRotationMatrix2D((img_w / 2, img_h / 2), 180, 1)
-        img = self.img.copy()
-        img = cv2.warpAffine(img, warp_matrix, (img_w, img_h), cv2.INTER_LINEAR)
-        self.img = img
-        self.set_img(img)
+        if self.sheet is None:
+            return
         self.reset_click_mode()
+        self.get_new_scan(self.sheet.raw, orientation=180 - self.sheet.orientation)
 
     def reset_click_mode(self):
         self.scan_preview.setCursor(Qt.ArrowCursor)
@@ -181,8 +213,8 @@ class ScanView(QMainWindow):
         self.enable_inputs()
         self.click_mode = ""
         self.corners = []
-        self.set_img(self.img)
         self.selected_img = 'img'
+        self.show_sheet('img')
 
     def check_data(self, data):
         errors = []
@@ -190,6 +222,9 @@ class ScanView(QMainWindow):
         for key in keys_to_check:
             if not (data[key] or data[key] in [False, 0]):
                 errors.append('missing_' + key)
+        pos_valid = 0 <= data['pos'] < len(self.scanner.POSITIONS)  # A misread barcode can give a pos of 6 to 9.
+        if not pos_valid:
+            errors.append('pos_out_of_range')
         if self.teams:
             if "frc{}".format(data['team_number']) not in self.teams:
                 errors.append('team_not_at_event')
@@ -197,13 +232,15 @@ class ScanView(QMainWindow):
             if data['match'] not in [e['match_number'] for e in self.matches]:
                 errors.append('match_number_not_at_event')
             alliance = 'red' if data['pos'] <= 2 else 'blue'
-            expected_team = [e for e in self.matches if e['match_number'] == data['match'] and e['comp_level'] == 'qm'][0]['alliances'][alliance]['team_keys'][data['pos'] % 3]
-            if "frc{}".format(data['team_number']) != expected_team:
-                errors.append('expected_different_team: {}'.format(expected_team))
+            quals = [e for e in self.matches if e['match_number'] == data['match'] and e['comp_level'] == 'qm']
+            if quals and pos_valid:
+                expected_team = quals[0]['alliances'][alliance]['team_keys'][data['pos'] % 3]
+                if "frc{}".format(data['team_number']) != expected_team:
+                    errors.append('expected_different_team: {}'.format(expected_team))
         return errors
 
     def submit_scan(self):
-        if self.img is None:
+        if self.sheet is None:
             return
         self.enable_inputs([])
 
@@ -231,49 +268,116 @@ class ScanView(QMainWindow):
             self.set_filepath_label_text(json.dumps(self.errors))
             self.enable_inputs()
             return
-        try:
-            data = json.load(open(self.data_filepath))
-        except:
-            data = []
+        self.save_entry(edited_data, self.sheet.marked)
+        self.get_new_scan()
+        self.enable_inputs()
 
-        data.append(edited_data)
-        json.dump(data, open(self.data_filepath, "w+"))
+    def save_entry(self, entry, marked_img):
+        """
+        Persists a submitted entry, writes it into the local database, queues it to be posted to Clooney and moves
+        its scan into Processed.
+        """
+        filename = entry["filename"]
+        self.results.append(entry)
+        replaced = self.database.upsert_entry(self.event_id, entry) if self.database is not None else None
+        if replaced is not None and replaced != filename:
+            print("Replaced the entry from {} for match {} position {}".format(replaced, entry["match"], entry["pos"]))
 
         data = {
-            'filename': self.filename,
-            'data': edited_data,
-            'team': int(edited_data["team_number"]),
-            'match': int(edited_data["match"]),
-            'pos': int(edited_data["pos"]),
+            'filename': filename,
+            'data': entry,
+            'team': int(entry["team_number"]),
+            'match': int(entry["match"]),
+            'pos': int(entry["pos"]),
             'event': self.event_id
         }
-
-        def post_func():
-            try:
-                requests.post('http://' + self.clooney_host + '/api/sql/add_entry', json=data)
-            except Exception as ex:
-                print(ex)
-        Runner(target=post_func).run()
+        self.outbox.put(data)
         self.generator_runner.run()
 
-        shutil.move(self.scan_dir.strip('\\') + self.filename, self.scan_dir + "Processed/" + self.filename)
-        cv2.imwrite(self.scan_dir + "Marked/" + self.filename, self.img)
-        self.get_new_scan()
-        self.enable_inputs()
+        shutil.move(self.scan_dir.strip('\\') + filename, self.scan_dir + "Processed/" + filename)
+        self.watcher.discard(filename)
+        cv2.imwrite(self.scan_dir + "Marked/" + filename, marked_img)
+
+    def update_status(self):
+        """
+        Shows the recent scan times, how far behind the Clooney uploads are and why the local database isn't being
+        used, if it isn't, in the status bar.
+        """
+        self.statusBar().showMessage(" | ".join(text for text in [self.scan_stats.summary_text(),
+                                                                  self.outbox.status_text(),
+                                                                  self.database_status] if text))
+
+    def closeEvent(self, event):
+        self.status_timer.stop()
+        self.prefetcher.shutdown()
+        self.watcher.close()
+        self.scanner.flush_images()
+        self.scan_stats.close()
+        self.outbox.close()
+        if self.database is not None:
+            self.database.close()
+        QMainWindow.closeEvent(self, event)
+
+    def auto_accept(self, data, marked_sheet):
+        """
+        Submits a sheet without review if auto_accept is on, every field was decoded with at least
+        auto_accept_confidence and the team, match and position are valid and agree with the TBA schedule.
+        Returns whether the sheet was submitted.
+        """
+        if not self.config.get("auto_accept", False) or not (self.teams and self.matches):
+            return False
+        if marked_sheet.confidence < self.config.get("auto_accept_confidence", 0.3):
+            return False
+        if self.check_data(data):
+            return False
+        entry = dict(data)
+        entry["filename"] = self.filename
+        self.save_entry(entry, marked_sheet.render())
+        print("Auto-accepted {}".format(self.filename))
+        return True
 
     def reject_scan(self):
-        if self.img is None:
+        if self.sheet is None:
             return
         shutil.move(self.scan_dir + self.filename, self.scan_dir + "Rejected/" + self.filename)
+        self.watcher.discard(self.filename)
         self.generator_runner.run()
         self.get_new_scan()
 
-    def set_img(self, cv_img):
-        self.current_img = np.copy(cv_img)
-        height, width, channels = cv_img.shape
-        cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
-        q_image = QImage(cv_img.data, width, height, width * 3, QImage.Format_RGB888)
-        self.scan_preview.setPixmap(QPixmap.fromImage(q_image))
+    def show_sheet(self, view, points=()):
+        """
+        Shows the raw or marked view of the current sheet at the preview's resolution, marking the given full
+        resolution points on it.
+        """
+        if self.sheet is None:
+            return
+        size = (self.scan_preview.width(), self.scan_preview.height())
+        preview = self.sheet.preview(view, size)
+        if not points:
+            self.scan_preview.setPixmap(self.sheet.derive(('pixmap', view, size), lambda: self.to_pixmap(preview)))
+            return
+        img = preview.copy()
+        full_height, full_width = self.sheet.view(view).shape[:2]
+        x_scale, y_scale = img.shape[1] / full_width, img.shape[0] / full_height
+        for x, y in points:
+            x, y = int(x * x_scale), int(y * y_scale)
+            cv2.rectangle(img, (x - 4, y - 4), (x + 4, y + 4), (0, 255, 0), thickness=2)
+        self.scan_preview.setPixmap(self.to_pixmap(img))
+
+    def show_blank(self):
+        self.sheet = None
+        self.scan_preview.setPixmap(QPixmap())
+
+    @staticmethod
+    def to_pixmap(cv_img):
+        height, width = cv_img.shape[:2]
+        cv_img = np.ascontiguousarray(cv_img)
+        if hasattr(QImage, 'Format_BGR888'):  # Qt 5.14+ can wrap the BGR buffer as is.
+            q_image = QImage(cv_img.data, width, height, cv_img.strides[0], QImage.Format_BGR888)
+        else:
+            cv_img = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+            q_image = QImage(cv_img.data, width, height, cv_img.strides[0], QImage.Format_RGB888)
+        return QPixmap.fromImage(q_image)
 
     def set_data(self, data):
         self.data_types = dict(zip(data.keys(), map(type, data.values())))
@@ -309,56 +413,84 @@ class ScanView(QMainWindow):
             else:
                 self.data_preview.setItem(row, 2, QTableWidgetItem(str(data[key])))
 
+    def highlight_ambiguous_fields(self, field_ids):
+        for row in range(self.data_preview.rowCount()):
+            key_item = self.data_preview.item(row, 0)
+            if key_item is not None and key_item.text() in field_ids:
+                key_item.setBackground(QColor(255, 224, 130))
+
+    def load_sheet_files(self):
+        template = load_template(self.fields_file, self.config_file, Scanner)
+        if template is self.template:
+            return False
+        self.template = template
+        self.config = template.config
+        self.field_list = template.fields
+        self.fields = dict(zip(map(lambda x: x['id'], self.field_list), self.field_list))
+        return True
+
     def look_for_scan(self):
-        self.config = json.load(open(self.config_file))
-        self.field_list = json.load(open(self.fields_file))
-        self.scanner.set_config(self.config)
-        self.scanner.set_fields(self.field_list)
+        if self.load_sheet_files():
+            self.scanner.set_template(self.template)
+            self.prefetcher.invalidate()
         self.enable_inputs([])
         self.update()
         self.get_new_scan()
         self.enable_inputs()
 
     def load_last_sheet(self):
-        try:
-            data = json.load(open(self.data_filepath))
-        except:
-            data = []
-        if data:
-            info = data[-1]
+        info = self.results.last()
+        if info is not None:
             self.filename = info['filename']
             del info['filename']
             shutil.move(self.scan_dir + "Processed/" + self.filename, self.scan_dir + self.filename)
             self.set_data(info)
-            self.set_img(cv2.imread(self.scan_dir + "Marked/" + self.filename))
+            marked_path = self.scan_dir + "Marked/" + self.filename
+            self.sheet = SheetImages(cv2.imread(self.scan_dir + self.filename), lambda: cv2.imread(marked_path))
+            self.selected_img = 'img'
+            self.show_sheet('img')
             self.set_filepath_label_text(self.filename)
             self.enable_inputs()
 
-            data = data[:-1]
-            json.dump(data, open(self.data_filepath, "w+"))
+            self.results.pop()
+            if self.database is not None:
+                self.database.delete_entry(self.event_id, self.filename)
+                self.restore_replaced_entry(info)
+
+    def restore_replaced_entry(self, entry):
+        """
+        Puts back the entry that a sheet taken back with Go Back had replaced in the local database. That's the
+        latest earlier result for the same match and position, if there is one.
+        """
+        for result in reversed(self.results.entries()):
+            if int(result["match"]) == int(entry["match"]) and int(result["pos"]) == int(entry["pos"]):
+                self.database.upsert_entry(self.event_id, result)
+                return
 
-    def get_new_scan(self, raw_scan=None):
+    def get_new_scan(self, raw_scan=None, orientation=None):
         self.enable_inputs([])
         if raw_scan is None:
-            try:
-                files = glob.glob(self.scan_dir + "*jpg") + glob.glob(self.scan_dir + "*.png")
-                selected_file = files[0]
-                self.filename = selected_file.split("/")[-1]
-                self.set_filepath_label_text(files[0])
-                raw_scan = cv2.imread(selected_file)
-            except Exception as ex:
-                print("Failed to read img")
-                self.filepath_label.setText(str(ex))
-                self.set_img(np.zeros((1, 1, 3), np.uint8))
-                self.set_data({})
-                self.refresh_button.setEnabled(True)
-                return
-
-        self.raw_img = np.copy(raw_scan)
-        data, marked_sheet = self.scanner.scan_sheet(raw_scan)
+            while True:
+                try:
+                    raw_scan, data, marked_sheet = self.read_next_scan()
+                except Exception as ex:
+                    print("Failed to read img")
+                    self.filepath_label.setText(str(ex))
+                    self.show_blank()
+                    self.set_data({})
+                    self.refresh_button.setEnabled(True)
+                    return
+                if not self.auto_accept(data, marked_sheet):
+                    break
+                QApplication.processEvents()
+        else:
+            data, marked_sheet = self.scanner.scan_sheet(raw_scan, orientation=orientation)
 
-        self.img = marked_sheet
-        self.set_img(self.img)
+        self.sheet = SheetImages(raw_scan, marked_sheet.render, marked_sheet.orientation)
+        self.selected_img = 'img'
+        self.show_sheet('img')
         self.set_data(data)
+        self.highlight_ambiguous_fields(marked_sheet.ambiguous_fields(self.config.get("review_margin", 0.2)))
+        self.update_status()
 
         self.enable_inputs()
@@ -0,0 +1,209 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections import OrderedDict
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+SCAN_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def is_scan(name, extensions=SCAN_EXTENSIONS):
+    """
+    Whether a file name has one of the scan extensions, whatever its case.
+    """
+    return name.lower().endswith(tuple(extensions))
+
+
+class _Inotify(object):
+    """
+    Minimal non-blocking inotify watch on a single directory, through libc.
+    """
+
+    def __init__(self, dirpath, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(dirpath), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def read(self):
+        """
+        Returns every queued (mask, name) event without blocking.
+        """
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((mask, os.fsdecode(name)))
+
+    def wait(self, timeout):
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ScanWatcher(object):
+    """
+    Keeps an ordered queue of the scans in a directory, in the order they finished arriving.
+
+    On Linux it follows inotify events, so files are only queued once they're closed after writing or moved in. If
+    inotify isn't available it falls back to polling: the directory is only listed again when its mtime changes, and
+    a new file is only queued once its size and mtime have held still for settle_time seconds.
+    """
+
+    def __init__(self, scan_dir, extensions=SCAN_EXTENSIONS, settle_time=0.5, poll_interval=0.5, use_inotify=True):
+        self.scan_dir = scan_dir
+        self._extensions = tuple(extensions)
+        self._settle_time = settle_time
+        self._poll_interval = poll_interval
+        self._queue = OrderedDict()
+        self._unsettled = {}
+        self._dir_mtime = None
+        self._inotify = None
+
+        if use_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify(scan_dir, IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE)
+            except (OSError, AttributeError) as ex:
+                print("Couldn't watch {} with inotify, polling instead: {}".format(scan_dir, ex))
+
+        self._dir_mtime = os.stat(scan_dir).st_mtime_ns
+        self._queue_existing()
+
+    def _is_scan(self, name):
+        return is_scan(name, self._extensions)
+
+    def _list_scans(self):
+        scans = {}
+        for entry in os.scandir(self.scan_dir):
+            if entry.is_file() and self._is_scan(entry.name):
+                stat = entry.stat()
+                scans[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return scans
+
+    def _queue_existing(self):
+        scans = self._list_scans()
+        for name in sorted(scans.keys(), key=lambda n: (scans[n][1], n)):
+            self._queue[name] = True
+
+    def _path(self, name):
+        return os.path.join(self.scan_dir, name)
+
+    def _handle_events(self):
+        arrived = []
+        for mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                arrived += self._resync()
+            elif mask & IN_ISDIR or not self._is_scan(name):
+                continue
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                self._queue.pop(name, None)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and name not in self._queue:
+                self._queue[name] = True
+                arrived.append(name)
+        return arrived
+
+    def _resync(self):
+        scans = self._list_scans()
+        for name in list(self._queue.keys()):
+            if name not in scans:
+                del self._queue[name]
+        arrived = [name for name in sorted(scans.keys(), key=lambda n: (scans[n][1], n)) if name not in self._queue]
+        for name in arrived:
+            self._queue[name] = True
+        return arrived
+
+    def _poll(self):
+        now = time.time()
+        dir_mtime = os.stat(self.scan_dir).st_mtime_ns
+        if dir_mtime != self._dir_mtime:
+            self._dir_mtime = dir_mtime
+            scans = self._list_scans()
+            for name in list(self._queue.keys()):
+                if name not in scans:
+                    del self._queue[name]
+            for name in list(self._unsettled.keys()):
+                if name not in scans:
+                    del self._unsettled[name]
+            for name in sorted(scans.keys(), key=lambda n: (scans[n][1], n)):
+                if name not in self._queue and name not in self._unsettled:
+                    self._unsettled[name] = (scans[name], now)
+
+        arrived = []
+        for name, (signature, since) in sorted(self._unsettled.items(), key=lambda item: item[1][1]):
+            try:
+                stat = os.stat(self._path(name))
+            except OSError:
+                del self._unsettled[name]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self._unsettled[name] = (current, now)
+            elif now - since >= self._settle_time:
+                del self._unsettled[name]
+                self._queue[name] = True
+                arrived.append(name)
+        return arrived
+
+    def refresh(self):
+        """
+        Picks up changes since the last refresh and returns the paths of scans that arrived.
+        """
+        arrived = self._handle_events() if self._inotify is not None else self._poll()
+        return [self._path(name) for name in arrived]
+
+    def wait(self, timeout=None):
+        """
+        Blocks until at least one scan arrives or the timeout runs out, returning the paths that arrived.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            arrived = self.refresh()
+            remaining = None if deadline is None else deadline - time.time()
+            if arrived or (remaining is not None and remaining <= 0):
+                return arrived
+            if self._inotify is not None:
+                self._inotify.wait(remaining)
+            else:
+                time.sleep(self._poll_interval if remaining is None else min(self._poll_interval, remaining))
+
+    def pending(self):
+        """
+        The paths of every queued scan, oldest first.
+        """
+        self.refresh()
+        return [self._path(name) for name in self._queue.keys()]
+
+    def discard(self, filepath):
+        """
+        Removes a scan from the queue, e.g. right after it's been moved away.
+        """
+        self._queue.pop(os.path.basename(filepath), None)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None